@@ -18,44 +18,190 @@ accurate.
 """
 
 import asyncio
-import copy
 import datetime
 import io
 import logging
 import re
 import typing
 
-import demoji
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
+from pymongo import ReturnDocument
 
 from app.birdbot import BirdBot
 from app.utils import checks
-from app.utils.config import Reference
+from app.utils.bulk_delete import DeleteQueue
+from app.utils.config import FloodLimits, Reference
+from app.utils.emoji_counter import count_emoji
+from app.utils.filter_matcher import FilterMatcher, PatternBundle, Whitelist, resolve_profanity, text_pieces
+from app.utils.fragments import FragmentTracker
 from app.utils.helper import create_automod_embed, is_external_command, is_internal_command
+from app.utils.log_sink import LogSink
+from app.utils.lru import LRUCache
+from app.utils.media_classifier import GIF, VIDEO, MediaClassifier, find_links, kind_of_content_type, kind_of_path
+from app.utils.member_tiers import member_tiers
+from app.utils.message_history import AUTHOR, CHANNEL, HistoryRecord, MessageHistory
+from app.utils.near_duplicates import CopypastaHit, NearDuplicateIndex
+from app.utils.nickname_sweep import NicknameSweep
+from app.utils.nicknames import NicknameFix, nickname_fix
+from app.utils.rate_limiter import USER, FloodLimiter, RateLimit
+from app.utils.scan_pool import ScanPool, find_profanity
+from app.utils.shadow_filter import ShadowFilter
+from app.utils.stage_timings import StageTimings
+from app.utils.text_normalizer import normalize
+from app.utils.verdict_cache import MISSING, VerdictCache
+
+
+class FilterProfile(typing.NamedTuple):
+    """
+    Compiled filter settings of a channel. Exempt channels have no matcher.
+    """
+
+    name: str
+    matcher: FilterMatcher | None
+    flood: FloodLimiter | None = None
+
+
+# action on gifs and videos posted in channels that don't allow them
+MEDIA_ACTION = {
+    "ping": "Please do not post gifs/videos in general",
+    "delete_after": 15,
+    "delete_message": "",
+    "log": "Media in #general",
+}
 
 
 class Filter(commands.Cog):
     def __init__(self, bot: BirdBot):
         self.logger = logging.getLogger("Automod")
         self.bot = bot
+        # latency histograms of the pipeline stages, off until a moderator turns them on
+        self.stage_timings = StageTimings(enabled=False)
 
         self.logging_channel_id = Reference.Channels.Logging.automod_actions
         self.logging_channel = None
-        self.message_history_list = {}
-        self.message_history_lock = asyncio.Lock()
+        # log embeds are sent in the background so they never delay an action
+        self.log_sink = LogSink(
+            lambda: self.logging_channel or self.bot.get_channel(self.logging_channel_id), maxsize=1000
+        )
+        self.message_history = MessageHistory(author_size=5, channel_size=10, ttl=3600, max_keys=50_000)
+        # pings allowed within the window over the last messages of an author
+        self.mention_limit = 5
+        self.mention_window = 30
+        self.fragment_tracker = FragmentTracker(max_fragment=6, max_fragments=8, window=20)
+        self.copypasta_index = NearDuplicateIndex(window=60, min_messages=8, min_authors=4, max_entries=10_000)
+        self.verdict_cache = VerdictCache(maxsize=4096)
+        # staged list changes, evaluated on a sample of messages before they go live
+        self.shadow_filter = ShadowFilter(sample_rate=0.1, max_hits=100, max_samples=1000)
+        # member id -> (name, nick, locked) the nickname rules were last passed or applied for
+        self.member_signatures: LRUCache[int, tuple] = LRUCache(maxsize=100_000)
+        # member id -> signature of a nickname edit that is queued or running
+        self.nickname_edits: typing.Dict[int, tuple] = {}
+        self.nickname_lock_id: int | None = None
+        self.nickname_sweep = NicknameSweep(
+            self.pending_nickname_fix,
+            self.bot.db.NicknameSweep,
+            chunk_size=1000,
+            edit_interval=1.0,
+            on_done=self.finish_nickname_fix,
+        )
+        self.nickname_sweep_interval = datetime.timedelta(days=1)
+        self.scan_pool = ScanPool(max_workers=2, max_pending=32, min_length=500)
+        self.pending_writes: typing.Set[asyncio.Task] = set()
+        self.delete_queue = DeleteQueue(bot, window=1.0)
+        # probing unknown links is off until a moderator turns it on
+        self.media_classifier = MediaClassifier(probe=False, max_concurrent_probes=4, timeout=2.0, ttl=3600)
+        self.pending_probes: typing.Set[asyncio.Task] = set()
+        # per user and per channel message rates of each profile, kept across rebuilds of the profiles
+        self.flood_limiters = {
+            name: FloodLimiter(user=RateLimit(*limits["user"]), channel=RateLimit(*limits["channel"]))
+            for name, limits in FloodLimits.profiles.items()
+        }
 
-        self.humanities_list: typing.List[str] = self.bot.db.filterlist.find_one({"name": "humanities"})["filter"]
-        self.general_list: typing.List[str] = self.bot.db.filterlist.find_one({"name": "general"})["filter"]
-        self.white_list: typing.List[str] = self.bot.db.filterlist.find_one({"name": "whitelist"})["filter"]
-        self.general_list_regex = self.generate_regex(self.general_list)
+        documents = {
+            name: self.bot.db.filterlist.find_one({"name": name}) for name in ("humanities", "general", "whitelist")
+        }
+        self.humanities_list: typing.List[str] = documents["humanities"]["filter"]
+        self.general_list: typing.List[str] = documents["general"]["filter"]
+        self.white_list: typing.List[str] = documents["whitelist"]["filter"]
+        self.whitelist = Whitelist(self.white_list)
+        # bumped on every write to a list so other instances can pick up the change
+        self.list_versions: typing.Dict[str, int] = {
+            name: document.get("version", 0) for name, document in documents.items()
+        }
 
-        self.humanities_list_regex = self.generate_regex(self.humanities_list)
+        self.bundles: typing.Dict[str, PatternBundle] = {}
+        self.bundles["general"] = self.generate_regex("general", self.general_list)
+        self.bundles["humanities"] = self.generate_regex("humanities", self.humanities_list)
+        self.channel_profiles: typing.Dict[int, FilterProfile] = {}
+        self.build_matchers()
+
+    async def cog_load(self):
+        self.poll_filter_lists.start()
+        self.sweep_flood_limiters.start()
+        self.log_sink.start()
+        self.shadow_filter.start()
+        self.scheduled_nickname_sweep.start()
+
+    async def cog_unload(self) -> None:
+        self.poll_filter_lists.cancel()
+        self.sweep_flood_limiters.cancel()
+        self.log_sink.stop()
+        self.shadow_filter.stop()
+        self.scheduled_nickname_sweep.cancel()
+        self.nickname_sweep.stop()
+        self.scan_pool.stop()
+        for task in self.pending_probes:
+            task.cancel()
+        await self.media_classifier.close()
+
+    @tasks.loop(seconds=15)
+    async def poll_filter_lists(self):
+        """
+        Reloads lists that were changed by another instance or directly in Mongo.
+        """
+        try:
+            documents = await asyncio.to_thread(
+                lambda: list(self.bot.db.filterlist.find({}, {"name": 1, "version": 1}))
+            )
+        except Exception:
+            self.logger.exception("Failed to poll filter list versions")
+            return
+
+        for document in documents:
+            name = document["name"]
+            if name in self.list_versions and document.get("version", 0) != self.list_versions[name]:
+                self.logger.info(f"Reloading changed filter list {name}")
+                await self.updatelist(name)
+
+    # drops the rate limit state of users and channels that went quiet
+    @tasks.loop(seconds=60)
+    async def sweep_flood_limiters(self):
+        for limiter in self.flood_limiters.values():
+            limiter.sweep()
+
+    # applies the nickname rules to members that haven't spoken or changed their name, once per interval
+    # counted from the last finished sweep, so reloading the cog doesn't start one right away
+    @tasks.loop(hours=1)
+    async def scheduled_nickname_sweep(self):
+        guild = self.bot.get_guild(Reference.guild)
+        if guild is None or self.nickname_sweep.running:
+            return
+        last = await self.nickname_sweep.last_finished(guild.id)
+        if last is not None and datetime.datetime.utcnow() - last < self.nickname_sweep_interval:
+            return
+        self.nickname_sweep.start(guild, on_finish=lambda status: self.log_sink.send(content=status))
+
+    @scheduled_nickname_sweep.before_loop
+    async def before_nickname_sweep(self):
+        await self.bot.wait_until_ready()
 
     @commands.Cog.listener()
     async def on_ready(self):
         self.logger.info("loaded Automod")
+        self.route_channels()
+        self.resolve_nickname_lock()
         self.logging_channel = await self.bot.fetch_channel(self.logging_channel_id)
 
     # declare command group
@@ -75,26 +221,173 @@ class Filter(commands.Cog):
         elif listtype == "humanities":
             return self.humanities_list
 
-    def return_regex(self, listtype):
+    # humanities is always checked together with general
+    def return_matcher(self, listtype) -> FilterMatcher:
+        if listtype == "humanities":
+            return self.humanities_matcher
+        return self.general_matcher
+
+    def build_matchers(self):
+        self.general_matcher, self.humanities_matcher = self.compile_matchers(self.bundles)
+        self.route_channels()
+        self.scan_pool.reload(self.pool_profiles(), self.white_list)
+
+    def compile_matchers(self, bundles: typing.Dict[str, PatternBundle]):
+        return FilterMatcher([bundles["general"]]), FilterMatcher([bundles["humanities"], bundles["general"]])
+
+    # rebuilds the matchers in a thread, the old ones keep filtering until the new ones are ready
+    async def rebuild_matchers(self):
+        bundles = dict(self.bundles)
+        matchers = await asyncio.to_thread(self.compile_matchers, bundles)
+        # a newer change already started its own rebuild
+        if bundles != self.bundles:
+            return
+        self.general_matcher, self.humanities_matcher = matchers
+        self.route_channels()
+        self.scan_pool.reload(self.pool_profiles(), self.white_list)
+        # the staged changes are evaluated on top of the new lists
+        if self.shadow_filter.changes:
+            await self.rebuild_candidate()
+
+    # compiles the staged changes on top of the live lists in a thread
+    async def rebuild_candidate(self):
+        shadow = self.shadow_filter
+        revision, bundles = shadow.revision, dict(self.bundles)
+        # only the staged words are compiled here, merging the lists runs in the thread
+        matchers = await asyncio.to_thread(self.compile_matchers, shadow.candidate_bundles(bundles))
+        # the changes or the lists changed again meanwhile
+        if revision != shadow.revision or bundles != self.bundles:
+            return
+        shadow.matchers = dict(zip(("general", "humanities"), matchers))
+
+    # Rebuilds the channel id -> profile table for every cached channel
+    def route_channels(self):
+        self.profiles = {
+            "general": FilterProfile("general", self.general_matcher, self.flood_limiters["general"]),
+            "humanities": FilterProfile("humanities", self.humanities_matcher, self.flood_limiters["humanities"]),
+            "exempt": FilterProfile("exempt", None),
+        }
+        channel_profiles = {}
+        guild = self.bot.get_guild(Reference.guild)
+        if guild is not None:
+            for channel in [*guild.channels, *guild.threads]:
+                channel_profiles[channel.id] = self.route_channel(channel)
+        self.channel_profiles = channel_profiles
+
+    def route_channel(self, channel) -> FilterProfile:
+        if isinstance(channel, discord.Thread) and channel.parent is not None:
+            return self.route_channel(channel.parent)
+        if (
+            channel.category_id == Reference.Categories.moderation  # mod category
+            and channel.id != Reference.Channels.bot_tests  # bot testing
+        ):
+            return self.profiles["exempt"]
+        if channel.category_id == Reference.Channels.language_tests:  # language testing
+            return self.profiles["exempt"]
+        if channel.name == "humanities":
+            return self.profiles["humanities"]
+        return self.profiles["general"]
+
+    # Returns the profile of a channel, channels created since the last rebuild are routed on first use
+    def channel_profile(self, channel) -> FilterProfile:
+        profile = self.channel_profiles.get(channel.id)
+        if profile is None:
+            if not isinstance(channel, discord.abc.GuildChannel | discord.Thread):
+                return self.profiles["exempt"]
+            profile = self.route_channel(channel)
+            self.channel_profiles[channel.id] = profile
+        return profile
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        if before.name != after.name or before.category_id != after.category_id:
+            self.route_channels()
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.channel_profiles.pop(channel.id, None)
+
+    # lists the scan pool workers compile
+    def pool_profiles(self):
+        return {
+            matcher.name: (matcher.version, matcher.words)
+            for matcher in (self.general_matcher, self.humanities_matcher)
+        }
+
+    # compiles the patterns of a list, bumping its version
+    def generate_regex(self, listtype, words) -> PatternBundle:
+        previous = self.bundles.get(listtype)
+        return PatternBundle(listtype, words, version=previous.version + 1 if previous else 1)
+
+    # Applies a single word change in memory, the Mongo write is confirmed in the background
+    async def update_word(self, listtype, word, add: bool):
+        words = self.return_list(listtype)
+        if add:
+            words.append(word)
+        else:
+            words[:] = [w for w in words if w != word]
+        self.verdict_cache.clear()
+
+        task = asyncio.create_task(self.write_word(listtype, word, add))
+        self.pending_writes.add(task)
+        task.add_done_callback(self.pending_writes.discard)
+
         if listtype == "whitelist":
-            return ""
-        elif listtype == "general":
-            return self.general_list_regex
-        elif listtype == "humanities":
-            return self.humanities_list_regex
+            self.whitelist = Whitelist(self.white_list)
+            self.scan_pool.reload(self.pool_profiles(), self.white_list)
+            return
+        bundle = self.bundles[listtype]
+        self.bundles[listtype] = bundle.add(word) if add else bundle.remove(word)
+        await self.rebuild_matchers()
+
+    async def write_word(self, listtype, word, add: bool):
+        update = {"$push": {"filter": word}} if add else {"$pull": {"filter": word}}
+        # taken before the write, a poll can resync the list while the write is in flight
+        previous = self.list_versions.get(listtype, 0)
+        try:
+            document = await asyncio.to_thread(
+                self.bot.db.filterlist.find_one_and_update,
+                {"name": listtype},
+                {**update, "$inc": {"version": 1}},
+                projection={"version": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if document is not None:
+                # only this write happened since the local copy was made, and nothing replaced it meanwhile
+                if document["version"] == previous + 1 and self.list_versions.get(listtype, 0) == previous:
+                    self.list_versions[listtype] = document["version"]
+                    return
+                # someone else changed the list in between
+            else:
+                self.logger.error(f"Filter list {listtype} was not modified by {update}")
+        except Exception:
+            self.logger.exception(f"Failed to write {update} to filter list {listtype}")
+        # resync with whatever is stored
+        await self.updatelist(listtype)
 
     # Updates filter list from Mongo based on listtype
+    # Fetching and compiling run in threads so messages are still filtered meanwhile
     async def updatelist(self, listtype):
+        document = await asyncio.to_thread(self.bot.db.filterlist.find_one, {"name": listtype})
+        self.list_versions[listtype] = document.get("version", 0)
+        self.verdict_cache.clear()
+
         if listtype == "whitelist":
-            self.white_list = self.bot.db.filterlist.find_one({"name": "whitelist"})["filter"]
+            self.white_list = document["filter"]
+            self.whitelist = Whitelist(self.white_list)
+            self.scan_pool.reload(self.pool_profiles(), self.white_list)
 
         elif listtype == "general":
-            self.general_list = self.bot.db.filterlist.find_one({"name": "general"})["filter"]
-            self.general_list_regex = self.generate_regex(self.general_list)
+            self.general_list = document["filter"]
+            self.bundles["general"] = await asyncio.to_thread(self.generate_regex, "general", self.general_list)
+            await self.rebuild_matchers()
 
         elif listtype == "humanities":
-            self.humanities_list = self.bot.db.filterlist.find_one({"name": "humanities"})["filter"]
-            self.humanities_list_regex = self.generate_regex(self.humanities_list)
+            self.humanities_list = document["filter"]
+            self.bundles["humanities"] = await asyncio.to_thread(
+                self.generate_regex, "humanities", self.humanities_list
+            )
+            await self.rebuild_matchers()
 
     @filter_commands.command()
     @checks.mod_and_above()
@@ -146,9 +439,7 @@ class Filter(commands.Cog):
             f"`{word}` added to the {list_type}{' list' if list_type != 'whitelist' else ''}."
         )
 
-        self.bot.db.filterlist.update_one({"name": list_type}, {"$push": {"filter": word}})
-
-        await self.updatelist(list_type)
+        await self.update_word(list_type, word, add=True)
 
     @filter_commands.command()
     @checks.mod_and_above()
@@ -179,9 +470,7 @@ class Filter(commands.Cog):
             f"`{word}` removed from the {list_type}{' list' if list_type != 'whitelist' else ''}."
         )
 
-        self.bot.db.filterlist.update_one({"name": list_type}, {"$pull": {"filter": word}})
-
-        await self.updatelist(list_type)
+        await self.update_word(list_type, word, add=False)
 
     @checks.mod_and_above()
     @filter_commands.command()
@@ -201,88 +490,362 @@ class Filter(commands.Cog):
         text: str
             Word or phrase to check
         """
-        file_list = copy.copy(self.return_list(list_type))
-        regex_list = copy.copy(self.return_regex(list_type))
-        word_list = file_list
-        if list_type == "humanities":
-            word_list += self.general_list
-            regex_list += self.general_list_regex
-
-        profanity = self.check_profanity(word_list, regex_list, text)
+        profanity = self.check_profanity(self.return_matcher(list_type), text)
         if profanity:
             await interaction.response.send_message(profanity)
         else:
             await interaction.response.send_message("No profanity.")
 
+    @filter_commands.command()
+    @checks.mod_and_above()
+    async def stats(self, interaction: discord.Interaction):
+        """
+        Show compile statistics of the filter lists.
+        """
+        embed = discord.Embed(title="Filter statistics", color=discord.Color.blurple())
+        for bundle in self.bundles.values():
+            embed.add_field(
+                name=bundle.name,
+                value=f"Version: {bundle.version}\nPatterns: {len(bundle)}\nCompile time: {bundle.compile_time * 1000:.2f}ms",
+                inline=False,
+            )
+        for name, matcher in (("general", self.general_matcher), ("humanities", self.humanities_matcher)):
+            embed.add_field(
+                name=f"{name} matcher",
+                value=f"Patterns: {len(matcher.words)}\nCompile time: {matcher.compile_time * 1000:.2f}ms",
+                inline=False,
+            )
+        pool = self.scan_pool
+        embed.add_field(
+            name="Scan pool",
+            value=f"Running: {pool.running}\nPending: {pool.pending}/{pool.max_pending}\nOffloaded: {pool.offloaded}\nShed: {pool.shed}",
+            inline=False,
+        )
+        cache = self.verdict_cache
+        embed.add_field(
+            name="Verdict cache",
+            value=f"Size: {len(cache)}/{cache.maxsize}\nHit rate: {cache.hit_rate:.1%} ({cache.hits} hits, {cache.misses} misses)\nEvictions: {cache.evictions}",
+            inline=False,
+        )
+        history = self.message_history
+        embed.add_field(
+            name="Message history",
+            value=f"Tracked: {len(history)}/{history.max_keys * 2}\nEvictions: {history.evictions}",
+            inline=False,
+        )
+        copypasta = self.copypasta_index
+        embed.add_field(
+            name="Copypasta index",
+            value=f"Messages: {len(copypasta)}/{copypasta.max_entries}\nClusters: {copypasta.clusters}\nFlagged: {copypasta.flagged}",
+            inline=False,
+        )
+        deletes = self.delete_queue
+        embed.add_field(
+            name="Deletions",
+            value=f"Deleted: {deletes.deleted}\nRequests: {deletes.requests}\nPending: {deletes.pending}",
+            inline=False,
+        )
+        media = self.media_classifier
+        embed.add_field(
+            name="Media links",
+            value=f"Probing: {'on' if media.probe_enabled else 'off'}\nProbed: {media.probed}\n"
+            f"Cache hits: {media.cache_hits}\nSkipped: {media.skipped}",
+            inline=False,
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @filter_commands.command()
+    @checks.mod_and_above()
+    async def nicknames(self, interaction: discord.Interaction, action: typing.Literal["start", "status", "stop"]):
+        """
+        Apply the nickname rules to every member of the server.
+
+        Parameters
+        ----------
+        action: str
+            Start or resume a sweep, show its progress or stop it
+        """
+        if action == "start":
+            assert interaction.guild
+            started = self.nickname_sweep.start(
+                interaction.guild, on_finish=lambda status: self.log_sink.send(content=status)
+            )
+            message = "Nickname sweep started." if started else "A nickname sweep is already running."
+        elif action == "stop":
+            stopped = self.nickname_sweep.stop()
+            message = "Nickname sweep stopped, it resumes on the next start." if stopped else "No sweep is running."
+        else:
+            message = self.nickname_sweep.status()
+        await interaction.response.send_message(message, ephemeral=True)
+
+    @filter_commands.command()
+    @checks.mod_and_above()
+    async def candidate(
+        self,
+        interaction: discord.Interaction,
+        list_type: typing.Literal["general", "humanities"],
+        word: str,
+        remove: bool = False,
+    ):
+        """
+        Stage a filter list change, it is evaluated on live messages until it is promoted.
+
+        Parameters
+        ----------
+        list_type: str
+            Type of list
+        word: str
+            Word or regex to add or remove
+        remove: bool
+            Stage removing the word instead of adding it
+        """
+        file_list = self.return_list(list_type)
+        if remove != (word in file_list):
+            state = "doesn't exist" if remove else "already exists"
+            await interaction.response.send_message(f"`{word}` {state} in {list_type} list.", ephemeral=True)
+            return
+        try:
+            PatternBundle(list_type, [word])
+        except re.error as e:
+            await interaction.response.send_message(f"`{word}` is not a valid pattern: {e}", ephemeral=True)
+            return
+        await interaction.response.send_message(
+            f"Staged {'removing' if remove else 'adding'} `{word}` {'from' if remove else 'to'} the {list_type} list, "
+            "see `/filter shadow view` for its evaluation."
+        )
+
+        self.shadow_filter.stage(list_type, word, add=not remove)
+        await self.rebuild_candidate()
+
+    @filter_commands.command()
+    @checks.mod_and_above()
+    async def shadow(self, interaction: discord.Interaction, action: typing.Literal["view", "promote", "discard"]):
+        """
+        Review the staged filter list changes.
+
+        Parameters
+        ----------
+        action: str
+            Show the evaluation report, apply the changes to the live lists or drop them
+        """
+        shadow = self.shadow_filter
+        if action == "view":
+            hits = "\n\n".join(
+                f"[{hit.timestamp:%Y-%m-%d %H:%M:%S}] {'new' if hit.new else 'cleared'} in {hit.profile} "
+                f"{hit.jump_url}\nWords: {', '.join(hit.words)}\n{hit.content}"
+                for hit in shadow.hits
+            )
+            await interaction.response.send_message(
+                shadow.report(),
+                file=(
+                    discord.File(io.BytesIO(hits.encode("UTF-8")), "shadow_hits.txt") if hits else discord.utils.MISSING
+                ),
+                ephemeral=True,
+            )
+            return
+        if not shadow.changes:
+            await interaction.response.send_message("No candidate changes are staged.", ephemeral=True)
+            return
+
+        changes = [(list_type, word, add) for list_type, words in shadow.changes.items() for word, add in words.items()]
+        shadow.discard()
+        if action == "discard":
+            await interaction.response.send_message("Candidate changes discarded.")
+            return
+        await interaction.response.send_message(
+            "Promoted the candidate changes:\n"
+            + "\n".join(f"{'+' if add else '-'} {list_type}: `{word}`" for list_type, word, add in changes)
+        )
+        for list_type, word, add in changes:
+            # the live list may have been changed directly meanwhile
+            if add != (word in self.return_list(list_type)):
+                await self.update_word(list_type, word, add)
+
+    @filter_commands.command()
+    @checks.mod_and_above()
+    async def latency(
+        self, interaction: discord.Interaction, action: typing.Literal["show", "enable", "disable", "reset"]
+    ):
+        """
+        Show how long every stage of automod takes.
+
+        Parameters
+        ----------
+        action: str
+            Show the histograms, start or stop recording them or clear them
+        """
+        timings = self.stage_timings
+        if action == "show":
+            histograms = timings.dump()
+            await interaction.response.send_message(
+                f"Recording: {'on' if timings.enabled else 'off'}, times in microseconds\n"
+                f"```\n{timings.summary()[:1900]}\n```",
+                file=(
+                    discord.File(io.BytesIO(histograms.encode("UTF-8")), "latency.txt")
+                    if histograms
+                    else discord.utils.MISSING
+                ),
+                ephemeral=True,
+            )
+            return
+        if action == "reset":
+            timings.reset()
+            message = "Latency histograms cleared."
+        else:
+            timings.enabled = action == "enable"
+            message = f"Latency recording {'enabled' if timings.enabled else 'disabled'}."
+        await interaction.response.send_message(message, ephemeral=True)
+
+    @filter_commands.command()
+    @checks.mod_and_above()
+    async def offload(self, interaction: discord.Interaction, enabled: bool):
+        """
+        Scan long messages in a process pool instead of the event loop.
+
+        Parameters
+        ----------
+        enabled: bool
+            Whether the scan pool should run
+        """
+        if enabled:
+            self.scan_pool.start(self.pool_profiles(), self.white_list)
+        else:
+            self.scan_pool.stop()
+        await interaction.response.send_message(f"Scan pool {'started' if enabled else 'stopped'}.", ephemeral=True)
+
+    @filter_commands.command()
+    @checks.mod_and_above()
+    async def probe(self, interaction: discord.Interaction, enabled: bool):
+        """
+        Probe links with an unknown extension and domain to find gifs and videos.
+
+        Parameters
+        ----------
+        enabled: bool
+            Whether unknown links should be probed
+        """
+        self.media_classifier.probe_enabled = enabled
+        await interaction.response.send_message(f"Link probing {'enabled' if enabled else 'disabled'}.", ephemeral=True)
+
     @commands.Cog.listener()
     async def on_member_update(self, before: discord.Member, after: discord.Member):
-        if before.nick == after.nick:
+        if before.roles != after.roles:
+            member_tiers.invalidate(after.id)
+        elif before.nick == after.nick:
             return
         await self.check_member(after)
 
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        if before.name == after.name:
+            return
+        guild = self.bot.get_guild(Reference.guild)
+        member = guild.get_member(after.id) if guild is not None else None
+        if member is not None:
+            await self.check_member(member)
+
+    # the Nickname Lock role is looked up by name once instead of on every check
+    def resolve_nickname_lock(self):
+        guild = self.bot.get_guild(Reference.guild)
+        role = discord.utils.get(guild.roles, name="Nickname Lock") if guild is not None else None
+        self.nickname_lock_id = role.id if role is not None else None
+        self.member_signatures.clear()
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        if role.name == "Nickname Lock":
+            self.resolve_nickname_lock()
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.name != after.name and "Nickname Lock" in (before.name, after.name):
+            self.resolve_nickname_lock()
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        if role.id == self.nickname_lock_id:
+            self.resolve_nickname_lock()
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
+        start = self.stage_timings.start()
+        await self.filter_message(message)
+        self.stage_timings.stop("on_message", start)
+
+    async def filter_message(self, message: discord.Message):
+        timings = self.stage_timings
         if isinstance(message.channel, discord.DMChannel):
             return
-        if (
-            message.channel.category.id == Reference.Categories.moderation
-            and message.channel.id != Reference.Channels.bot_tests
-        ):
+        # mod category and language testing
+        start = timings.start()
+        exempt = self.channel_profile(message.channel).matcher is None
+        timings.stop("category", start)
+        if exempt:
             return
-
-        if message.channel.category.id == Reference.Channels.language_tests:  # language testing
-            return
-        if self.is_member_excluded(message.author):
+        start = timings.start()
+        excluded = self.is_member_excluded(message.author)
+        timings.stop("exclusion", start)
+        if excluded:
             return
 
         if message.content == "":
-            if self.check_gif_bypass(message):
-                await self.execute_action_on_message(
-                    message,
-                    {
-                        "ping": "Please do not post gifs/videos in general",
-                        "delete_after": 15,
-                        "delete_message": "",
-                        "log": "Media in #general",
-                    },
-                )
+            # attachments and stickers count towards the flood limits like any other message
+            if await self.check_flood(message):
+                return
+            start = timings.start()
+            bypass = self.check_gif_bypass(message)
+            timings.stop("gif_bypass", start)
+            if bypass:
+                await self.execute_action_on_message(message, MEDIA_ACTION)
             return
 
-        if is_internal_command(self.bot, message):
+        start = timings.start()
+        internal = is_internal_command(self.bot, message)
+        timings.stop("internal_command", start)
+        if internal:
             return
 
-        if is_external_command(message):
+        start = timings.start()
+        external = is_external_command(message)
+        timings.stop("external_command", start)
+        if external:
             return
 
         self.logging_channel = self.bot.get_channel(self.logging_channel_id)
         if not isinstance(message.channel, discord.DMChannel):
+            if await self.check_flood(message):
+                return
             await self.check_message(message)
             await self.check_member(message.author)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        start = self.stage_timings.start()
+        await self.filter_edit(before, after)
+        self.stage_timings.stop("on_message_edit", start)
+
+    async def filter_edit(self, before: discord.Message, after: discord.Message):
+        timings = self.stage_timings
         if after.channel.id == Reference.Channels.bot_commands:
             return
 
-        if self.is_member_excluded(after.author):
+        start = timings.start()
+        excluded = self.is_member_excluded(after.author)
+        timings.stop("exclusion", start)
+        if excluded:
             return
 
-        if (
-            before.channel.category.id == Reference.Categories.moderation  # mod category
-            and before.channel.id != Reference.Channels.bot_tests  # bot testing
-        ):
+        start = timings.start()
+        exempt = self.channel_profile(after.channel).matcher is None
+        timings.stop("category", start)
+        if exempt:
             return
         if before.content == after.content:
-            if self.check_gif_bypass(after):
-                await self.execute_action_on_message(
-                    after,
-                    {
-                        "ping": "Please do not post gifs/videos in general",
-                        "delete_after": 15,
-                        "delete_message": "",
-                        "log": "Media in #general",
-                    },
-                )
+            start = timings.start()
+            bypass = self.check_gif_bypass(after)
+            timings.stop("gif_bypass", start)
+            if bypass:
+                await self.execute_action_on_message(after, MEDIA_ACTION)
             return
         if not isinstance(after.channel, discord.DMChannel):
             await self.check_message(after)
@@ -293,57 +856,63 @@ class Filter(commands.Cog):
         if member.bot:
             return
 
-        nickname_lock = discord.utils.get(member.guild.roles, name="Nickname Lock")
-        if nickname_lock in member.roles:
-            if member.name != "Kurzgesagt Fan":
-                await member.edit(nick="Kurzgesagt Fan")
-
-        if member.nick is None:
-            if not re.search(r"[a-zA-Z0-9~!@#$%^&*()_+`;':\",./<>?]{3,}", member.name, re.IGNORECASE):
-                await member.edit(nick="Unpingable Username")
-            if any(s in member.name for s in ("nazi", "hitler", "führer", "fuhrer")):
-                await member.edit(nick="Parrot")
-
+        start = self.stage_timings.start()
+        fix = self.pending_nickname_fix(member)
+        self.stage_timings.stop("nickname", start)
+        if fix is not None:
+            start = self.stage_timings.start()
+            renamed = False
+            try:
+                await member.edit(nick=fix.nick)
+                renamed = True
+            finally:
+                self.finish_nickname_fix(member, renamed)
+                self.stage_timings.stop("discord", start)
+
+    # the rules only run again once the names or the lock changed, or the fix wasn't applied.
+    # a member whose edit is still queued or running is skipped, so the next messages don't edit them again meanwhile
+    def pending_nickname_fix(self, member) -> NicknameFix | None:
+        if member.id in self.nickname_edits:
+            return None
+        locked = self.nickname_lock_id is not None and member.get_role(self.nickname_lock_id) is not None
+        signature = (member.name, member.nick, locked)
+        if self.member_signatures.get(member.id) == signature:
+            return None
+        fix = nickname_fix(member.name, member.nick, locked)
+        if fix is None:
+            self.member_signatures.put(member.id, signature)
         else:
-            if not re.search(r"[a-zA-Z0-9~!@#$%^&*()_+`;':\",./<>?]{3,}", member.nick, re.IGNORECASE):
-                await member.edit(nick="Unpingable Nickname")
-            if any(s in member.nick for s in ("nazi", "hitler", "führer", "fuhrer")):
-                await member.edit(nick=None)
+            self.nickname_edits[member.id] = signature
+        return fix
+
+    # the signature is only recorded once the edit went through, otherwise the rules run again
+    # on the member's next message or sweep
+    def finish_nickname_fix(self, member, renamed: bool):
+        signature = self.nickname_edits.pop(member.id, None)
+        if renamed and signature is not None:
+            self.member_signatures.put(member.id, signature)
 
     async def execute_action_on_message(self, message: discord.Message, actions):
         # TODO: make embeds more consistent once mod policy is set
-        if "ping" in actions:
-            if "delete_after" in actions:
-                await message.channel.send(
-                    f"{actions.get('ping') } {message.author.mention}",
-                    delete_after=actions.get("delete_after"),
-                )
-            else:
-                await message.channel.send(
-                    f"{actions.get('ping')} {message.author.mention}",
-                    delete_after=30,
-                )
-
+        # removal goes first, the delete queue sends it as soon as the loop is free
         if "delete_message" in actions:
-            if isinstance(actions["delete_message"], int):
-                async with self.message_history_lock:
-                    for i in range(4):
-                        await self.message_history_list[actions["delete_message"]][i].delete()
-                    self.message_history_list[actions["delete_message"]] = self.message_history_list[
-                        actions["delete_message"]
-                    ][4:]
+            if isinstance(actions["delete_message"], tuple):
+                # taken out of the history before the first await, so a concurrent check can't delete them twice
+                self.delete_records(self.message_history.pop_oldest(*actions["delete_message"], 4))
             else:
-                await message.delete()
+                self.delete_queue.delete(message.channel.id, [message.id])
 
+        # the remaining calls run concurrently, a failing one doesn't stop the others
+        calls = []
         if "mute" in actions:
-            time = datetime.timedelta(seconds=actions["mute"])
-            await message.author.timeout(time, reason="spam")
-
-            try:
-                await message.author.send(f"You have been muted for 30 minutes.\nGiven reason: Spam\n")
-
-            except discord.Forbidden:
-                pass
+            calls.append(self.mute_author(message, actions["mute"]))
+        if "ping" in actions:
+            calls.append(
+                message.channel.send(
+                    f"{actions.get('ping')} {message.author.mention}",
+                    delete_after=actions.get("delete_after", 30),
+                )
+            )
 
         # if "warn" in actions:
         # logic for warn here
@@ -353,110 +922,100 @@ class Filter(commands.Cog):
 
         if "log" in actions:
             embed = create_automod_embed(message=message, automod_type=actions.get("log"))
-            await self.logging_channel.send(embed=embed)
+            self.log_sink.send(embed=embed)
+
+        start = self.stage_timings.start()
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        self.stage_timings.stop("discord", start)
+        for result in results:
+            if isinstance(result, Exception):
+                self.logger.error(f"Automod action on message {message.id} failed: {result!r}")
+
+    async def mute_author(self, message: discord.Message, seconds: int):
+        time = datetime.timedelta(seconds=seconds)
+        await message.author.timeout(time, reason="spam")  # type: ignore
+
+        try:
+            await message.author.send(f"You have been muted for {seconds // 60} minutes.\nGiven reason: Spam\n")
+
+        except discord.Forbidden:
+            pass
+
+    # queues messages that are only known from their history records for deletion
+    def delete_records(self, records: typing.List[HistoryRecord]):
+        for record in records:
+            self.delete_queue.delete(record.channel_id, [record.id])
 
     def is_member_excluded(self, author):
-        rolelist = [
-            Reference.Roles.moderator,  # mod
-            Reference.Roles.administrator,  # admin
-            Reference.Roles.kgsofficial,  # offical
-            Reference.Roles.robobird,  # robobird
-            Reference.Roles.stealthbot,  # stealth
-        ]
-        if author.bot:
-            return True
-        if any(x in [role.id for role in author.roles] for x in rolelist):
-            return True
-        return False
+        # bots, mods, admins, officials, robobird and stealth
+        return member_tiers.get(author).automod_exempt
 
-    def check_profanity(self, ref_word_list, regex_list, message_clean):
-        # filter out bold and italics but keep *
-        indexes = re.finditer("(\*\*.*?\*\*)", message_clean)
-        if indexes:
-            tracker = 0
-            for i in indexes:
-                message_clean = message_clean.replace(
-                    message_clean[i.start() - tracker : i.end() - tracker],
-                    message_clean[i.start() + 2 - tracker : i.end() - 2 - tracker],
-                )
-                tracker = tracker + 4
-        indexes = re.finditer(r"(\*.*?\*)", message_clean)
-        if indexes:
-            tracker = 0
-            for i in indexes:
-                message_clean = message_clean.replace(
-                    message_clean[i.start() - tracker : i.end() - tracker],
-                    message_clean[i.start() + 1 - tracker : i.end() - 1 - tracker],
-                )
-                tracker = tracker + 2
-        # Changes letter emojis to normal ascii ones
-        message_clean = self.convert_regional(message_clean)
-        # changes cyrllic letters into ascii ones
-        message_clean = self.convert_letters(message_clean)
-        # find all question marks in message
-        indexes = [x.start() for x in re.finditer(r"\?", message_clean)]
-        # get rid of all other non ascii characters
-        message_clean = demoji.replace(message_clean, "*")
-        message_clean = str(message_clean).encode("ascii", "replace").decode().lower().replace("?", "*")
-        # put back question marks
-        message_clean = list(message_clean)
-        for i in indexes:
-            message_clean[i] = "?"
-        message_clean = "".join(message_clean)
-        # sub out discord emojis
-        message_clean = re.sub(r"(<[A-z]*:[^\s]+:[0-9]*>)", "*", message_clean)
-        dirty_list = []
-        for regex in regex_list:
-            if re.search(regex, message_clean):
-                found_items = re.findall(regex[:-3] + "[A-z]*)", message_clean)
-                for e in found_items:
-                    dirty_list.append(e)
-        clean_list = []
-        # test to see if any word is within a already existing word
-        for test_word in dirty_list:
-            found = False
-            for to_match in dirty_list:
-                if (
-                    test_word[0] in to_match[0]
-                    and len(test_word[0]) < len(to_match[0])
-                    and test_word[1] >= to_match[1]
-                    and test_word[2] < to_match[2]
-                ):
-                    found = True
-                    break
-            if not found:
-                clean_list.append(test_word)
-        # does the final check to see if any word is not in the whitelist
-        for bad_word in clean_list:
-            if not bad_word in self.white_list:
-                return clean_list
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        member_tiers.invalidate(member.id)
+
+    def check_profanity(self, matcher: FilterMatcher, content: str):
+        message_clean, key, verdict = self.cached_verdict(matcher, content)
+        if verdict is MISSING:
+            start = self.stage_timings.start()
+            verdict = self.match_profanity(matcher, message_clean)
+            self.stage_timings.stop("matching", start)
+            self.verdict_cache.put(key, verdict)
+        return verdict
+
+    # check_profanity that runs long messages in the scan pool
+    async def scan_profanity(self, matcher: FilterMatcher, content: str):
+        if not self.scan_pool.offloads(content):
+            return self.check_profanity(matcher, content)
+
+        message_clean, key, verdict = self.cached_verdict(matcher, content)
+        if verdict is MISSING:
+            start = self.stage_timings.start()
+            verdict = await self.scan_pool.run(find_profanity, matcher.name, matcher.version, message_clean)
+            self.stage_timings.stop("matching", start)
+            # the pool shed the scan, the text is scanned in the loop instead. nothing is cached,
+            # so the same text goes to the pool again once it has room
+            if verdict is None:
+                return await self.scan_in_pieces(matcher, message_clean)
+            self.verdict_cache.put(key, verdict)
+        return verdict
+
+    # scans the text a piece at a time, each no longer than the messages scanned in the loop anyway.
+    # yielding between the pieces keeps a burst of long messages from holding up the loop
+    async def scan_in_pieces(self, matcher: FilterMatcher, message_clean: str):
+        for piece in text_pieces(message_clean, self.scan_pool.min_length, overlap=100):
+            start = self.stage_timings.start()
+            verdict = self.match_profanity(matcher, piece)
+            self.stage_timings.stop("matching", start)
+            if verdict:
+                return verdict
+            await asyncio.sleep(0)
         return False
 
+    # normalized text of a message with the cache key and cached verdict of the matcher for it
+    def cached_verdict(self, matcher: FilterMatcher, content: str):
+        # strip markdown and custom emoji, fold everything else into lowercase ascii
+        start = self.stage_timings.start()
+        message_clean = normalize(content).text
+        self.stage_timings.stop("normalize", start)
+
+        # repeated messages reuse the verdict until a list changes
+        key = (matcher.name, matcher.version, hash(message_clean))
+        return message_clean, key, self.verdict_cache.get(key)
+
+    def match_profanity(self, matcher: FilterMatcher, message_clean: str):
+        # every list word is matched in a single scan
+        return resolve_profanity(matcher.find(message_clean), self.whitelist, message_clean)
+
     def exception_list_check(self, offending_list):
-        for bad_word in offending_list:
-            if not bad_word in self.white_list:
-                return False
-        return True
+        return all(bad_word in self.whitelist for bad_word in offending_list)
 
     # check for emoji spam
     def check_emoji_spam(self, message):
         if message.channel.id == Reference.Channels.new_members:  # new-members
             return False
 
-        if (
-            len(
-                re.findall(
-                    r"((<a?)?:\w+:(\d{18}>)?)",
-                    re.sub(
-                        r"(>[\s]*<)+",
-                        "> <",
-                        str(message.content).encode("ascii", "ignore").decode(),
-                    ),
-                )
-            )
-            + len(demoji.findall_list(message.content))
-            > 5
-        ):
+        if count_emoji(message.content) > 5:
             return True
         return False
 
@@ -465,27 +1024,66 @@ class Filter(commands.Cog):
         if message.channel.id == Reference.Channels.new_members:  # new-members
             return False
 
-        # if the user has past messages
-        if message.author.id in self.message_history_list:
-            count = len(self.message_history_list[message.author.id])
-            if count > 3:
-                if all(m.content == message.content for m in self.message_history_list[message.author.id][0:4]):
-                    return message.author.id
+        # the oldest four messages of the author or the channel are the same
+        content_hash = hash(message.content)
+        for namespace, key in ((AUTHOR, message.author.id), (CHANNEL, message.channel.id)):
+            records = self.message_history.records(namespace, key)
+            if len(records) > 3 and all(r.content_hash == content_hash for r in records[:4]):
+                return namespace, key
+
+    # moderators decide whether a cluster of similar messages is a raid, the messages are left alone
+    def log_copypasta(self, message: discord.Message, raid: CopypastaHit):
+        embed = create_automod_embed(message=message, automod_type="Copypasta")
+        embed.title = "Copypasta, no messages deleted."
+        channels = {record.channel_id for record in raid.records}
+        embed.add_field(
+            name="Cluster",
+            value=f"Messages: {len(raid.records)}\nAccounts: {raid.authors}\nChannels: {len(channels)}",
+            inline=False,
+        )
+        links = [
+            f"https://discord.com/channels/{Reference.guild}/{record.channel_id}/{record.id}"
+            for record in raid.records[-5:]
+        ]
+        embed.add_field(name="Latest messages", value="\n".join(links), inline=False)
+        self.log_sink.send(embed=embed)
+
+    # check for too many messages from a user or in a channel, only new messages count
+    async def check_flood(self, message) -> bool:
+        limiter = self.channel_profile(message.channel).flood
+        if limiter is None:
+            return False
+        start = self.stage_timings.start()
+        flood = limiter.check(message.author.id, message.channel.id)
+        self.stage_timings.stop("flood", start)
+        if flood is None:
+            return False
+
+        if flood.scope != USER:
+            # a busy channel or a raid of many accounts, the messages of the users within their own
+            # limits are left alone and still filtered, moderators are told once
+            if flood.strikes == 1:
+                embed = create_automod_embed(message=message, automod_type="Channel flood")
+                embed.title = "Channel flood, no messages deleted."
+                self.log_sink.send(embed=embed)
+            return False
 
-        if message.channel.id in self.message_history_list:
-            if len(self.message_history_list[message.channel.id]) > 3:
-                if all(m.content == message.content for m in self.message_history_list[message.channel.id][0:4]):
-                    return message.channel.id
+        if flood.strikes == 1:
+            actions = {"ping": "Please slow down", "delete_after": 15, "delete_message": ""}
+        elif flood.strikes < 3:
+            actions = {"delete_message": ""}
+        else:
+            actions = {"delete_message": "", "log": "Flood", "mute": 600}
+            limiter.forgive(USER, message.author.id)
+        await self.execute_action_on_message(message, actions)
+        return True
 
-    # check for mass ping
+    # check for mass ping, spread over the recent messages of the author
     def check_ping_spam(self, message):
-        if len(message.mentions) > 5:
-            return ["True", "ping"]
+        return self.message_history.mentions(message.author.id, self.mention_window) > self.mention_limit
 
     # check for gif bypass
     def check_gif_bypass(self, message):
-        filetypes = ["mp4", "gif", "webm", "gifv", "mov"]
-
         if message.channel.id not in (
             Reference.Channels.the_perch,
             Reference.Channels.general,
@@ -493,42 +1091,53 @@ class Filter(commands.Cog):
             Reference.Channels.humanities,
         ):
             return
-        # This is too aggressive and shouldn't be necessary. Leaving it commented for now though.
-        """for f in filetypes:
-            if "." + f in message.content:
-                return True"""
+        media = self.media_classifier
 
-        if message.embeds:
-            for e in message.embeds:
-                if any(s in e.type for s in filetypes):
-                    return True
-                elif e.thumbnail:
-                    if any(s in e.thumbnail.url for s in filetypes):
-                        return True
-                elif e.image:
-                    if any(s in e.image.url for s in filetypes):
-                        return True
-        if message.attachments:
-            for e in message.attachments:
-                if any(s in e.filename for s in filetypes):
-                    return True
-                elif any(s in e.url for s in filetypes):
+        for e in message.embeds:
+            if e.type == "gifv":
+                return True
+            for url in (e.thumbnail.url, e.image.url, e.video.url):
+                if url and media.is_media(url):
                     return True
+        for a in message.attachments:
+            if a.content_type and kind_of_content_type(a.content_type) in (GIF, VIDEO):
+                return True
+            if kind_of_path(a.filename) in (GIF, VIDEO) or media.is_media(a.url):
+                return True
+
+        # links are checked before discord embeds them, unknown ones are probed in the background
+        probes = []
+        for url in find_links(message.content)[:3]:
+            kind = media.classify_link(url)
+            if isinstance(kind, asyncio.Future):
+                probes.append(kind)
+            elif kind in (GIF, VIDEO):
+                return True
+        if probes:
+            task = asyncio.create_task(self.act_on_probes(message, probes))
+            self.pending_probes.add(task)
+            task.add_done_callback(self.pending_probes.discard)
         return False
 
-    async def check_message(self, message):
-        word_list = copy.copy(self.return_list(message.channel.name))
-        regex_list = copy.copy(self.return_regex(message.channel.name))
-        if word_list is None:
-            word_list = copy.copy(self.general_list)
-            regex_list = copy.copy(self.general_list_regex)
-
-        if message.channel.name == "humanities":
-            word_list += self.general_list
-            regex_list += self.general_list_regex
+    async def act_on_probes(self, message, probes):
+        """
+        Acts on a message once the probes of its unknown links are back.
+        """
+        kinds = await asyncio.gather(*probes, return_exceptions=True)
+        if any(kind in (GIF, VIDEO) for kind in kinds):
+            await self.execute_action_on_message(message, MEDIA_ACTION)
 
+    async def check_message(self, message):
+        timings = self.stage_timings
         # run checks
-        is_profanity = self.check_profanity(word_list, regex_list, message.content)
+        profile = self.channel_profile(message.channel)
+        if profile.matcher is None:
+            return
+        start = timings.start()
+        self.shadow_filter.offer(profile.name, profile.matcher, self.whitelist, message.content, message.jump_url)
+        timings.stop("shadow", start)
+
+        is_profanity = await self.scan_profanity(profile.matcher, message.content)
         if is_profanity:
             await self.execute_action_on_message(
                 message,
@@ -542,9 +1151,12 @@ class Filter(commands.Cog):
             embed = create_automod_embed(message=message, automod_type="profanity")
             embed.add_field(name="Blacklisted Word", value=is_profanity[:1024], inline=False)
             file = discord.File(io.BytesIO(message.content.encode("UTF-8")), f"log.txt")
-            await self.logging_channel.send(embed=embed, file=file)
+            self.log_sink.send(embed=embed, file=file)
             return
-        if self.check_emoji_spam(message):
+        start = timings.start()
+        emoji_spam = self.check_emoji_spam(message)
+        timings.stop("emoji", start)
+        if emoji_spam:
             await self.execute_action_on_message(
                 message,
                 {
@@ -555,60 +1167,66 @@ class Filter(commands.Cog):
                 },
             )
             return
-        if self.check_ping_spam(message):
-            # why is nothing here
-            return [True, "ping"]
-        if self.check_gif_bypass(message):
+
+        # if getting past this point we write to message history, edits replace their earlier record
+        # the history is only touched by synchronous code between awaits, so it needs no lock
+        start = timings.start()
+        record = self.message_history.add(message)
+        timings.stop("history", start)
+        start = timings.start()
+        message_clean = normalize(message.content).text
+        timings.stop("normalize", start)
+
+        # words split over several short messages
+        start = timings.start()
+        split = self.fragment_tracker.check(record, message_clean, profile.matcher, self.whitelist)
+        timings.stop("fragments", start)
+        if split:
+            self.delete_records(split.records)
+            await self.execute_action_on_message(
+                message,
+                {
+                    "ping": "Be nice, Don't say bad things",
+                    "delete_after": 30,
+                    "log": "Split profanity",
+                },
+            )
+            return
+
+        start = timings.start()
+        ping_spam = self.check_ping_spam(message)
+        timings.stop("ping_spam", start)
+        if ping_spam:
+            # cleared before the first await, so the next messages in the window don't count the same pings again
+            self.message_history.forgive_mentions(message.author.id)
             await self.execute_action_on_message(
                 message,
                 {
-                    "ping": "Please do not post gifs/videos in general",
+                    "ping": "Please do not mass ping",
                     "delete_after": 15,
                     "delete_message": "",
-                    "log": "Media in #general",
+                    "log": "Mass ping",
+                    "mute": 600,
                 },
             )
             return
+        start = timings.start()
+        bypass = self.check_gif_bypass(message)
+        timings.stop("gif_bypass", start)
+        if bypass:
+            await self.execute_action_on_message(message, MEDIA_ACTION)
+            return
 
-        # this one goes last due to lock
-        async with self.message_history_lock:
-            # if getting past this point we write to message history and pop if to many messages
-
-            if message.author.id in self.message_history_list:
-                found = False
-                for n in self.message_history_list[message.author.id]:
-                    if message.id == n.id:
-                        found = True
-                        # update existing message with edits if any
-                        self.message_history_list[message.author.id][
-                            self.message_history_list[message.author.id].index(n)
-                        ] = message
-                if not found:
-                    self.message_history_list[message.author.id].append(message)
-            else:
-                self.message_history_list[message.author.id] = [message]
-
-            if message.channel.id in self.message_history_list:
-                found = False
-                for n in self.message_history_list[message.channel.id]:
-                    if message.id == n.id:
-                        found = True
-                        # update existing message with edits if any
-                        self.message_history_list[message.channel.id][
-                            self.message_history_list[message.channel.id].index(n)
-                        ] = message
-                if not found:
-                    self.message_history_list[message.channel.id].append(message)
-            else:
-                self.message_history_list[message.channel.id] = [message]
-
-            if len(self.message_history_list[message.author.id]) > 5:
-                self.message_history_list[message.author.id].pop(0)
-
-            if len(self.message_history_list[message.channel.id]) > 10:
-                self.message_history_list[message.channel.id].pop(0)
+        # the same text posted with small changes by several accounts
+        start = timings.start()
+        raid = self.copypasta_index.add(record, message_clean)
+        timings.stop("copypasta", start)
+        if raid:
+            self.log_copypasta(message, raid)
 
+        start = timings.start()
         spam = self.check_text_spam(message)
+        timings.stop("text_spam", start)
         if spam:
             await self.execute_action_on_message(
                 message,
@@ -621,129 +1239,6 @@ class Filter(commands.Cog):
                 },
             )
 
-    def convert_regional(self, word):
-        replacement = {
-            "🇦": "a",
-            "🇧": "b",
-            "🇨": "c",
-            "🇩": "d",
-            "🇪": "e",
-            "🇫": "f",
-            "🇬": "g",
-            "🇭": "h",
-            "🇮": "i",
-            "🇯": "j",
-            "🇰": "k",
-            "🇱": "l",
-            "🇲": "m",
-            "🇳": "n",
-            "🇴": "o",
-            "🇵": "p",
-            "🇶": "q",
-            "🇷": "r",
-            "🇸": "s",
-            "🇹": "t",
-            "🇺": "u",
-            "🇻": "v",
-            "🇼": "w",
-            "🇽": "x",
-            "🇾": "y",
-            "🇿": "z",
-        }
-
-        counter = 0
-        to_return = ""
-        letter_list = list(word)
-        for letter in letter_list:
-            if replacement.get(letter) is not None:
-                to_return = to_return + replacement.get(letter)
-            else:
-                to_return = to_return + letter
-            counter = counter + 1
-        return to_return
-
-    def convert_letters(self, word):
-        replacement = {
-            "а": "a",
-            "в": "b",
-            "с": "c",
-            "е": "e",
-            "н": "h",
-            "к": "k",
-            "м": "m",
-            "и": "n",
-            "о": "o",
-            "р": "p",
-            "🇷": "r",
-            "т": "t",
-            "ш": "w",
-            "х": "x",
-            "у": "y",
-            "“": '"',
-            "”": '"',
-            "’": "'",
-            "⁰": "0",
-            "¹": "1",
-            "²": "2",
-            "³": "3",
-            "⁴": "4",
-            "⁵": "5",
-            "⁶": "6",
-            "⁷": "7",
-            "⁸": "8",
-            "⁹": "9",
-            "′": "'",
-        }
-
-        to_return = ""
-        letter_list = list(word)
-        for letter in letter_list:
-            if replacement.get(letter.lower()) is not None:
-                to_return = to_return + replacement.get(letter.lower())
-            else:
-                to_return = to_return + letter
-        return to_return
-
-    def generate_regex(self, words):
-        joining_chars = r'[ _\-\+\.\*!@#$%^&():;\[\]\}\{\'"]*'
-        replacement = {
-            "a": r"4a\@\#",
-            "b": r"b\*",
-            "c": r"c¢\*",
-            "d": r"d\*",
-            "e": r"e3\*",
-            "f": r"f\*",
-            "g": r"g\*",
-            "h": r"h\*",
-            "i": r"!1il\*",
-            "j": r"!j\*",
-            "k": r"k\*",
-            "l": r"!1il\*",
-            "m": r"m\*",
-            "n": r"n\*",
-            "o": r"o0\*",
-            "p": r"pq\*",
-            "q": r"qp\*",
-            "r": r"r\*",
-            "s": r"s$\*",
-            "t": r"t\+\*",
-            "u": r"uv\*",
-            "v": r"vu\*",
-            "w": r"w\*",
-            "x": r"x\*",
-            "y": r"y\*",
-            "z": r"z\*",
-            " ": r" _\-\+\.*",
-        }
-        regexlist = []
-        for word in words:
-            regex_parts = []
-            for c in word:
-                regex_parts.append(f"[{replacement.get(c)}]")
-            regex = r"\b(" + joining_chars.join(regex_parts) + r")\b"
-            regexlist.append(regex)
-        return regexlist
-
 
 async def setup(bot: BirdBot):
     await bot.add_cog(Filter(bot))
@@ -0,0 +1,104 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Coalesced bulk deletion of messages removed by automod.
+
+The first deletion in a channel is sent right away. Deletions queued while it is in
+flight, and during a short window after it, are sent together through the bulk delete
+endpoint, up to 100 messages per call. Discord only bulk deletes messages younger than
+14 days, older ones are deleted one by one.
+"""
+
+import asyncio
+import datetime
+import logging
+import typing
+
+import discord
+
+logger = logging.getLogger("BulkDelete")
+
+# bulk delete rejects messages older than 14 days, keep a margin for clock drift
+MAX_BULK_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+MAX_BULK_SIZE = 100
+
+
+class DeleteQueue:
+    """
+    Per channel queues of message ids that are deleted in batches.
+    """
+
+    def __init__(self, bot: discord.Client, window: float = 1.0):
+        self.bot = bot
+        self.window = window
+        self._pending: typing.Dict[int, typing.Set[int]] = {}
+        self._workers: typing.Dict[int, asyncio.Task] = {}
+        self.requests = 0
+        self.deleted = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(ids) for ids in self._pending.values())
+
+    def delete(self, channel_id: int, message_ids: typing.Iterable[int]):
+        """
+        Queues messages of a channel for deletion.
+        """
+        self._pending.setdefault(channel_id, set()).update(message_ids)
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(self._work(channel_id))
+
+    async def _work(self, channel_id: int):
+        try:
+            # runs until nothing was queued during a whole window
+            while self._pending.get(channel_id):
+                message_ids = self._pending.pop(channel_id)
+                try:
+                    await self._flush(channel_id, sorted(message_ids))
+                except Exception:
+                    logger.exception(f"Failed to delete messages in {channel_id}")
+                await asyncio.sleep(self.window)
+        finally:
+            del self._workers[channel_id]
+
+    async def _flush(self, channel_id: int, message_ids: typing.List[int]):
+        oldest = discord.utils.utcnow() - MAX_BULK_AGE
+        recent = [i for i in message_ids if discord.utils.snowflake_time(i) > oldest]
+        single = [i for i in message_ids if discord.utils.snowflake_time(i) <= oldest]
+
+        channel = self.bot.get_channel(channel_id)
+        if isinstance(channel, discord.TextChannel | discord.Thread | discord.VoiceChannel):
+            for start in range(0, len(recent), MAX_BULK_SIZE):
+                chunk = recent[start : start + MAX_BULK_SIZE]
+                if len(chunk) == 1:
+                    single.extend(chunk)
+                    continue
+                self.requests += 1
+                try:
+                    await channel.delete_messages([discord.Object(i) for i in chunk], reason="Automod")
+                    self.deleted += len(chunk)
+                except discord.HTTPException:
+                    # e.g. a message of the batch was deleted already
+                    single.extend(chunk)
+        else:
+            single.extend(recent)
+
+        messageable = self.bot.get_partial_messageable(channel_id)
+        for message_id in single:
+            self.requests += 1
+            try:
+                await messageable.get_partial_message(message_id).delete()
+                self.deleted += 1
+            except discord.NotFound:
+                # already removed by another check
+                pass
@@ -20,6 +20,7 @@ from discord.ext import commands
 
 from .config import Reference
 from .errors import InvalidAuthorizationError, InvalidInvocationError
+from .member_tiers import ADMIN_ROLES, MODERATOR_ROLES, PATREON_ROLES
 
 
 def check(predicate):
@@ -53,9 +54,7 @@ def mod_and_above():
         user = info.user if isinstance(info, Interaction) else info.author
         assert isinstance(user, discord.Member)
 
-        user_role_ids = [x.id for x in user.roles]
-        check_role_ids = Reference.Roles.moderator_and_above()
-        if not any(x in user_role_ids for x in check_role_ids):
+        if not MODERATOR_ROLES.intersection(role.id for role in user.roles):
             raise InvalidAuthorizationError
         return True
 
@@ -71,9 +70,7 @@ def admin_and_above():
         user = info.user if isinstance(info, Interaction) else info.author
         assert isinstance(user, discord.Member)
 
-        user_role_ids = [x.id for x in user.roles]
-        check_role_ids = Reference.Roles.admin_and_above()
-        if not any(x in user_role_ids for x in check_role_ids):
+        if not ADMIN_ROLES.intersection(role.id for role in user.roles):
             raise InvalidAuthorizationError
         return True
 
@@ -181,9 +178,7 @@ def topic_perm_check():
 
         check_role = guild.get_role(Reference.Roles.duck)
 
-        user_role_ids = [x.id for x in user.roles]
-        check_role_ids = Reference.Roles.patreon()
-        if user.top_role >= check_role or any(x in user_role_ids for x in check_role_ids):
+        if user.top_role >= check_role or PATREON_ROLES.intersection(role.id for role in user.roles):
             return True
         raise InvalidAuthorizationError(content="This can only be ran by ducks+ and patreon members")
 
@@ -201,9 +196,7 @@ def patreon_only():
 
         member = client.get_guild(Reference.guild).get_member(user.id)  # type: ignore
         assert member
-        member_role_ids = [x.id for x in member.roles]
-        check_role_ids = Reference.Roles.patreon()
-        if not any(x in member_role_ids for x in check_role_ids):
+        if not PATREON_ROLES.intersection(role.id for role in member.roles):
             raise InvalidAuthorizationError
         return True
 
@@ -172,3 +172,14 @@ class ExclusiveColors:
         "Nitro Pink": {"id": 976157185971204157, "unlockers": [Reference.Roles.nitro_bird]},
         "Contributor Gold": {"id": 976176253826654329, "unlockers": [Reference.Roles.contributor]},
     }
+
+
+class FloodLimits:
+    """
+    Messages allowed per user and per channel of every filter profile, as (messages, seconds).
+    """
+
+    profiles = {
+        "general": {"user": (8, 10), "channel": (40, 10)},
+        "humanities": {"user": (6, 10), "channel": (20, 10)},
+    }
@@ -0,0 +1,94 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Emoji counting for the automod emoji spam check.
+
+The codepoints of every emoji known to demoji are merged into a range table once, when
+the module is imported. The table is compiled into a single pattern that matches custom
+emoji, shortcodes and whole unicode emoji sequences (ZWJ sequences, skin tones, flags,
+keycaps and tag sequences), so a message is counted in one scan without looking up any
+emoji descriptions.
+"""
+
+import importlib.resources
+import json
+import re
+import typing
+
+ZWJ = 0x200D
+VARIATION_SELECTORS = (0xFE0E, 0xFE0F)
+KEYCAP = 0x20E3
+SKIN_TONES = (0x1F3FB, 0x1F3FF)
+REGIONAL_INDICATORS = (0x1F1E6, 0x1F1FF)
+TAGS = (0xE0020, 0xE007F)
+
+
+def _load_codepoints() -> typing.Set[int]:
+    """
+    Returns the codepoints an emoji sequence can start with.
+    """
+    codes = json.loads(importlib.resources.files("demoji").joinpath("codes.json").read_text("utf-8"))
+    codepoints = {ord(char) for code in codes for char in code}
+    # ascii only shows up in keycaps, the rest only inside of sequences
+    codepoints = {c for c in codepoints if c > 0x7F}
+    codepoints -= {ZWJ, KEYCAP, *VARIATION_SELECTORS}
+    codepoints -= set(range(TAGS[0], TAGS[1] + 1))
+    codepoints -= set(range(REGIONAL_INDICATORS[0], REGIONAL_INDICATORS[1] + 1))
+    return codepoints
+
+
+def _merge_ranges(codepoints: typing.Iterable[int]) -> typing.List[typing.Tuple[int, int]]:
+    ranges: typing.List[typing.Tuple[int, int]] = []
+    for codepoint in sorted(codepoints):
+        if ranges and ranges[-1][1] == codepoint - 1:
+            ranges[-1] = (ranges[-1][0], codepoint)
+        else:
+            ranges.append((codepoint, codepoint))
+    return ranges
+
+
+def _char_class(ranges: typing.Iterable[typing.Tuple[int, int]]) -> str:
+    return "[" + "".join(f"\\U{a:08x}" if a == b else f"\\U{a:08x}-\\U{b:08x}" for a, b in ranges) + "]"
+
+
+EMOJI_RANGES = _merge_ranges(_load_codepoints())
+
+_BASE = _char_class(EMOJI_RANGES)
+_SELECTOR = _char_class([(VARIATION_SELECTORS[0], VARIATION_SELECTORS[1])]) + "?"
+_SKIN_TONE = _char_class([SKIN_TONES]) + "?"
+_TAG_SEQUENCE = f"(?:{_char_class([(TAGS[0], TAGS[1] - 1)])}+\\U{TAGS[1]:08x})?"
+_ELEMENT = _BASE + _SELECTOR + _SKIN_TONE
+
+_EMOJI = re.compile(
+    "|".join(
+        (
+            r"<a?:[A-Za-z0-9_]+:\d+>",  # custom emoji
+            r":[A-Za-z0-9_]+:",  # shortcodes of emoji that weren't converted
+            f"[0-9#*]{_SELECTOR}\\u20e3",  # keycaps
+            f"{_char_class([REGIONAL_INDICATORS])}{{2}}",  # flags
+            f"{_ELEMENT}{_TAG_SEQUENCE}(?:\\u200d{_ELEMENT})*",  # emoji and ZWJ sequences
+        )
+    )
+)
+_CUSTOM_EMOJI = re.compile(r"<a?:[A-Za-z0-9_]+:\d+>|:[A-Za-z0-9_]+:")
+
+
+def count_emoji(content: str) -> int:
+    """
+    Counts custom and unicode emoji in a message.
+    """
+    pattern = _CUSTOM_EMOJI if content.isascii() else _EMOJI
+    count = 0
+    for _ in pattern.finditer(content):
+        count += 1
+    return count
@@ -0,0 +1,372 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Multi-pattern matcher used by the automod filter.
+
+Every filter word is turned into a sequence of character classes (leetspeak substitutes)
+separated by optional joining characters. Instead of running one regex per word on every
+message, all words are folded into a prefix tree and compiled into a single pattern that
+is scanned once per message. Only the positions where that scan hits are confirmed against
+the individual word patterns.
+
+Word patterns are compiled once per list into a versioned PatternBundle. Adding or removing
+a word creates a new version of the bundle in which only the added word is compiled.
+
+Matches are reported as spans so nested matches can be dropped with a single sweep, and
+whitelisted words are looked up in a set.
+"""
+
+import copy
+import re
+import time
+import typing
+
+
+def _char_class(chars: typing.Iterable[str]) -> str:
+    # consecutive characters are written as a range, which keeps the merged pattern small
+    codes = sorted(ord(c) for c in chars)
+    parts = []
+    start = 0
+    for i, code in enumerate(codes):
+        if i + 1 < len(codes) and codes[i + 1] == code + 1:
+            continue
+        if i - start >= 2:
+            parts.append(re.escape(chr(codes[start])) + "-" + re.escape(chr(code)))
+        else:
+            parts.extend(re.escape(chr(c)) for c in codes[start : i + 1])
+        start = i + 1
+    return "[" + "".join(parts) + "]"
+
+
+# characters that may be skipped between the letters of a word. Leetspeak substitutes and `*`
+# are joining characters too, so a letter found in a run of them could be taken from many
+# places of the run, which made the patterns backtrack exponentially on long runs.
+_JOINERS = frozenset(" _-+.*!@#$%^&():;[]{}'\"")
+# the rest of a run of joining characters, taken without backtracking, see joined_letter
+SKIPPED_RUN = _char_class(_JOINERS) + "*+"
+# before the last letter any part of the run may be skipped, so a word can end on a substitute
+JOINING_CHARS = _char_class(_JOINERS) + "*"
+
+CHARACTER_CLASSES = {
+    "a": r"4a\@\#",
+    "b": r"b\*",
+    "c": r"c¢\*",
+    "d": r"d\*",
+    "e": r"e3\*",
+    "f": r"f\*",
+    "g": r"g\*",
+    "h": r"h\*",
+    "i": r"!1il\*",
+    "j": r"!j\*",
+    "k": r"k\*",
+    "l": r"!1il\*",
+    "m": r"m\*",
+    "n": r"n\*",
+    "o": r"o0\*",
+    "p": r"pq\*",
+    "q": r"qp\*",
+    "r": r"r\*",
+    "s": r"s$\*",
+    "t": r"t\+\*",
+    "u": r"uv\*",
+    "v": r"vu\*",
+    "w": r"w\*",
+    "x": r"x\*",
+    "y": r"y\*",
+    "z": r"z\*",
+    " ": r" _\-\+\.*",
+}
+
+
+def word_to_tokens(word: str) -> typing.List[str]:
+    """
+    Returns the character class of every letter in the word.
+    """
+    return [f"[{CHARACTER_CLASSES.get(c)}]" for c in word]
+
+
+def _token_chars(token: str) -> typing.Set[str]:
+    return set(re.sub(r"\\(.)", r"\1", token[1:-1]))
+
+
+def joined_letter(token: str) -> str:
+    """
+    Returns the regex of a letter together with the joining characters before it.
+
+    The letter is taken from the first place of a joining run it matches, or the whole run is
+    skipped and the letter follows it. Either way there is a single way to match the letters
+    of a word, and a run matched by the old `[...]*` joiner is still matched.
+    """
+    chars = _token_chars(token)
+    alternatives = []
+    if chars & _JOINERS:
+        alternatives.append(_char_class(chars & _JOINERS))
+    if chars - _JOINERS:
+        alternatives.append(SKIPPED_RUN + _char_class(chars - _JOINERS))
+    # the joining characters the letter doesn't match come before either place, so they are
+    # skipped once for both. The classes don't overlap, nothing is given back on a failed match
+    return _char_class(_JOINERS - chars) + "*+(?:" + "|".join(alternatives) + ")"
+
+
+def tokens_to_regex(tokens: typing.List[str]) -> str:
+    """
+    Joins character classes into the detection regex of a single word.
+    """
+    body = tokens[0] + "".join(joined_letter(token) for token in tokens[1:-1])
+    if len(tokens) > 1:
+        body += JOINING_CHARS + tokens[-1]
+    return r"\b(" + body + r")\b"
+
+
+class PatternBundle:
+    """
+    Precompiled detection and word extension patterns of a single filter list.
+
+    The version is bumped every time the list is recompiled.
+    """
+
+    def __init__(self, name: str, words: typing.Sequence[str], version: int = 1):
+        start = time.perf_counter()
+
+        self.name = name
+        self.version = version
+        self.words = tuple(words)
+        self.tokens = [word_to_tokens(word) for word in self.words]
+        # detection pattern and the pattern that also captures the rest of the word
+        self.patterns = [re.compile(tokens_to_regex(t)) for t in self.tokens]
+        self.extended = [re.compile(tokens_to_regex(t)[:-3] + "[A-z]*)") for t in self.tokens]
+
+        self.compile_time = time.perf_counter() - start
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, word: str) -> "PatternBundle":
+        """
+        Returns a new version of the bundle with the word added, only that word is compiled.
+        """
+        start = time.perf_counter()
+
+        bundle = copy.copy(self)
+        tokens = word_to_tokens(word)
+        bundle.version = self.version + 1
+        bundle.words = self.words + (word,)
+        bundle.tokens = self.tokens + [tokens]
+        bundle.patterns = self.patterns + [re.compile(tokens_to_regex(tokens))]
+        bundle.extended = self.extended + [re.compile(tokens_to_regex(tokens)[:-3] + "[A-z]*)")]
+
+        bundle.compile_time = time.perf_counter() - start
+        return bundle
+
+    def remove(self, word: str) -> "PatternBundle":
+        """
+        Returns a new version of the bundle without the word, nothing is recompiled.
+        """
+        keep = [i for i, w in enumerate(self.words) if w != word]
+
+        bundle = copy.copy(self)
+        bundle.version = self.version + 1
+        bundle.words = tuple(self.words[i] for i in keep)
+        bundle.tokens = [self.tokens[i] for i in keep]
+        bundle.patterns = [self.patterns[i] for i in keep]
+        bundle.extended = [self.extended[i] for i in keep]
+        bundle.compile_time = 0.0
+        return bundle
+
+
+class Span(typing.NamedTuple):
+    """
+    A filtered word found in a message, the end is exclusive.
+    """
+
+    start: int
+    end: int
+    text: str
+
+
+class _TrieNode:
+    __slots__ = ("children", "terminal")
+
+    def __init__(self):
+        self.children: typing.Dict[str, _TrieNode] = {}
+        self.terminal = False
+
+
+class FilterMatcher:
+    """
+    Matches a message against a whole filter list in a single pass.
+
+    The word patterns are merged into a prefix tree which is compiled into one
+    lookahead pattern, so every start position of a possible match is found by a
+    single scan. Candidate positions are then confirmed with the precompiled word
+    patterns, and only confirmed words are expanded into their matched spans.
+    """
+
+    def __init__(self, bundles: typing.Sequence[PatternBundle]):
+        start = time.perf_counter()
+
+        self.bundles = tuple(bundles)
+        self.name = "+".join(bundle.name for bundle in self.bundles)
+        self.version = tuple(bundle.version for bundle in self.bundles)
+        self.words = [word for bundle in self.bundles for word in bundle.words]
+
+        tokens = [t for bundle in self.bundles for t in bundle.tokens]
+        self._first_tokens = [re.compile(t[0]) if t else None for t in tokens]
+        self._patterns = [pattern for bundle in self.bundles for pattern in bundle.patterns]
+        self._extended = [pattern for bundle in self.bundles for pattern in bundle.extended]
+        # char -> indexes of the words that can start with it, filled lazily
+        self._starts: typing.Dict[str, typing.Tuple[int, ...]] = {}
+
+        root = _TrieNode()
+        for t in tokens:
+            node = root
+            for token in t:
+                node = node.children.setdefault(token, _TrieNode())
+            node.terminal = True
+
+        self._scanner = re.compile(r"(?=\b(?:" + self._branches(root) + "))") if self.words else None
+        self.compile_time = time.perf_counter() - start
+
+    def _branches(self, node: _TrieNode) -> str:
+        alternatives = [r"\b"] if node.terminal else []
+        for token, child in node.children.items():
+            alternatives.append(token + self._continuation(child))
+        return "|".join(alternatives)
+
+    def _continuation(self, node: _TrieNode, can_end: bool = True) -> str:
+        alternatives = [r"\b"] if node.terminal and can_end else []
+        last = []
+        for token, child in node.children.items():
+            if child.terminal:
+                last.append(token)
+            # longer words go on from the child, the word ending there is matched by `last`
+            if child.children:
+                alternatives.append(joined_letter(token) + self._continuation(child, can_end=False))
+        # the last letter of a word, see JOINING_CHARS
+        if last:
+            alternatives.append(JOINING_CHARS + "(?:" + "|".join(last) + r")\b")
+        return "(?:" + "|".join(alternatives) + ")"
+
+    def _words_starting_with(self, char: str) -> typing.Tuple[int, ...]:
+        indexes = self._starts.get(char)
+        if indexes is None:
+            indexes = tuple(
+                i for i, first in enumerate(self._first_tokens) if first is None or first.fullmatch(char) is not None
+            )
+            self._starts[char] = indexes
+        return indexes
+
+    def find(self, text: str) -> typing.List[Span]:
+        """
+        Returns the span of every filtered word found in the text.
+
+        Words are reported in filter list order, each followed by the rest of the
+        word it was found in.
+        """
+        if self._scanner is None:
+            return []
+
+        confirmed: typing.Set[int] = set()
+        for candidate in self._scanner.finditer(text):
+            pos = candidate.start()
+            char = text[pos] if pos < len(text) else ""
+            for i in self._words_starting_with(char):
+                if i not in confirmed and self._patterns[i].match(text, pos):
+                    confirmed.add(i)
+
+        found = []
+        for i in sorted(confirmed):
+            found.extend(Span(m.start(), m.end(), m.group(1)) for m in self._extended[i].finditer(text))
+        return found
+
+
+class Whitelist:
+    """
+    Whitelisted words and phrases.
+
+    Single words are compared with the matched text through a set. Phrases are compiled
+    into one pattern, matches that lie within a whitelisted phrase of the message are allowed.
+    """
+
+    def __init__(self, entries: typing.Iterable[str]):
+        self.words = frozenset(entries)
+        phrases = sorted({entry.lower() for entry in self.words if " " in entry.strip()}, key=len, reverse=True)
+        self._phrases = re.compile("|".join(re.escape(phrase) for phrase in phrases)) if phrases else None
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def __len__(self):
+        return len(self.words)
+
+    def phrase_spans(self, text: str) -> typing.List[typing.Tuple[int, int]]:
+        """
+        Returns the spans of the whitelisted phrases in the text, in order.
+        """
+        if self._phrases is None:
+            return []
+        return [m.span() for m in self._phrases.finditer(text)]
+
+
+def text_pieces(text: str, size: int, overlap: int) -> typing.Iterator[str]:
+    """
+    Splits the text into pieces of at most `size` characters that overlap by about `overlap`.
+
+    Pieces are cut at spaces where possible, a word cut in half could match as a shorter word.
+    A match spanning a cut is still seen whole as long as it is shorter than the overlap.
+    """
+    start = 0
+    while len(text) - start > size:
+        end = text.rfind(" ", start + 1, start + size)
+        if end == -1:
+            end = start + size
+        yield text[start:end]
+        # the next piece starts at the first word that ends less than `overlap` before the cut
+        space = text.find(" ", max(end - overlap - 1, start), end)
+        start = space + 1 if space != -1 else end
+    yield text[start:]
+
+
+def drop_nested(spans: typing.Iterable[Span]) -> typing.List[Span]:
+    """
+    Drops spans that lie within another span, the rest is returned in text order.
+    """
+    kept = []
+    reach = -1
+    # sorted by start and longest first, a nested span always comes after the span containing it
+    for span in sorted(set(spans), key=lambda span: (span.start, -span.end)):
+        if span.end <= reach:
+            continue
+        kept.append(span)
+        reach = span.end
+    return kept
+
+
+def resolve_profanity(spans: typing.Iterable[Span], whitelist: Whitelist, text: str) -> typing.List[str] | bool:
+    """
+    Drops matches nested in other matches and returns the rest, or False if all are whitelisted.
+    """
+    clean_list = drop_nested(spans)
+
+    phrases = whitelist.phrase_spans(text) if clean_list else []
+    # both lists are in text order, so the phrases are swept alongside the matches
+    i = 0
+    for span in clean_list:
+        if span.text in whitelist:
+            continue
+        while i < len(phrases) and phrases[i][1] < span.end:
+            i += 1
+        if i < len(phrases) and phrases[i][0] <= span.start:
+            continue
+        return [span.text for span in clean_list]
+    return False
@@ -0,0 +1,128 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Detection of filtered words split over several short messages.
+
+The last few short messages of an author in a channel are kept as a bounded tail. When a
+new fragment arrives only the suffixes of the tail that end with it are scanned, so the
+cost does not grow with the history and a word is reported once, by the fragment that
+completes it.
+"""
+
+import time
+import typing
+from collections import OrderedDict
+
+from .filter_matcher import FilterMatcher, Whitelist, resolve_profanity
+from .message_history import HistoryRecord
+
+
+class _Tail:
+    __slots__ = ("fragments", "records", "touched")
+
+    def __init__(self):
+        self.fragments: typing.List[str] = []
+        self.records: typing.List[HistoryRecord] = []
+        self.touched = 0.0
+
+
+class SplitHit(typing.NamedTuple):
+    """
+    Words completed by a fragment and the messages they were spread over.
+    """
+
+    words: typing.List[str]
+    records: typing.List[HistoryRecord]
+
+
+class FragmentTracker:
+    """
+    Bounded per author and channel tails of recent short messages.
+    """
+
+    def __init__(self, max_fragment: int = 6, max_fragments: int = 8, window: float = 20, max_keys: int = 10_000):
+        self.max_fragment = max_fragment
+        self.max_fragments = max_fragments
+        self.window = window
+        self.max_keys = max_keys
+        # least recently touched first
+        self._tails: OrderedDict[typing.Tuple[int, int], _Tail] = OrderedDict()
+
+    def __len__(self):
+        return len(self._tails)
+
+    def check(self, record: HistoryRecord, text: str, matcher: FilterMatcher, whitelist: Whitelist) -> SplitHit | None:
+        """
+        Adds a normalized message, returns the words it completes together with the previous fragments.
+        """
+        key = (record.author_id, record.channel_id)
+        fragment = "".join(text.split())
+        self.evict(record.timestamp)
+
+        # a longer message ends the sequence, it was already checked on its own
+        if not fragment or len(fragment) > self.max_fragment:
+            self._tails.pop(key, None)
+            return None
+
+        tail = self._tails.get(key)
+        if tail is None:
+            tail = self._tails[key] = _Tail()
+        else:
+            self._tails.move_to_end(key)
+        # edits are not added again
+        if any(r.id == record.id for r in tail.records):
+            return None
+        tail.touched = record.timestamp
+        tail.fragments = (tail.fragments + [fragment])[-self.max_fragments :]
+        tail.records = (tail.records + [record])[-self.max_fragments :]
+        if len(tail.fragments) < 2:
+            return None
+
+        # every suffix of at least two fragments, separated so each one ends a word
+        suffixes = ["".join(tail.fragments[i:]) for i in range(len(tail.fragments) - 1)]
+        scanned = " ".join(suffixes)
+        ends = set()
+        end = -1
+        for suffix in suffixes:
+            end += len(suffix) + 1
+            ends.add(end)
+
+        # only words that end with the new fragment and start in an earlier one
+        spans = [span for span in matcher.find(scanned) if span.end in ends and len(span.text) > len(fragment)]
+        words = resolve_profanity(spans, whitelist, scanned)
+        if not words:
+            return None
+        del self._tails[key]
+
+        # only the messages the longest word was spread over
+        length = max(len(span.text) for span in spans)
+        count = 0
+        for fragment in reversed(tail.fragments):
+            length -= len(fragment)
+            count += 1
+            if length <= 0:
+                break
+        return SplitHit(words, tail.records[-count:])  # type: ignore
+
+    def evict(self, now: float | None = None):
+        """
+        Drops tails that have been idle longer than the window and the least recently used past the cap.
+        """
+        if now is None:
+            now = time.monotonic()
+        tails = self._tails
+        while tails:
+            key, tail = next(iter(tails.items()))
+            if now - tail.touched <= self.window and len(tails) <= self.max_keys:
+                break
+            del tails[key]
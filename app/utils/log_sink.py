@@ -0,0 +1,73 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Background sink for log messages, so sending them never delays a moderation action.
+"""
+
+import asyncio
+import logging
+import typing
+
+import discord
+
+logger = logging.getLogger("LogSink")
+
+
+class LogSink:
+    """
+    Bounded queue of messages that a background task sends to a log channel.
+
+    When the queue is full the oldest message is dropped.
+    """
+
+    def __init__(self, get_channel: typing.Callable[[], discord.abc.Messageable | None], maxsize: int = 1000):
+        self.get_channel = get_channel
+        self._queue: asyncio.Queue[typing.Dict[str, typing.Any]] = asyncio.Queue(maxsize)
+        self._worker: asyncio.Task | None = None
+        self.sent = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._work())
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def send(self, **kwargs):
+        """
+        Queues a message, takes the same arguments as `Messageable.send`.
+        """
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(kwargs)
+
+    async def _work(self):
+        while True:
+            kwargs = await self._queue.get()
+            channel = self.get_channel()
+            if channel is None:
+                logger.warning("Log channel is not available, dropping message")
+                self.dropped += 1
+                continue
+            try:
+                await channel.send(**kwargs)
+                self.sent += 1
+            except Exception:
+                logger.exception("Failed to send log message")
@@ -0,0 +1,294 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Classification of links and attachments into gifs, videos and everything else.
+
+A link is classified by the extension of its path, then by its domain. Links that neither
+tells anything about can optionally be probed with a HEAD request (or a one byte range
+request if HEAD is refused). Probing is off by default. Probes run in the background and
+never hold up a message: a message with an unknown link gets a future of the probe, and
+the result is cached by URL (without fragment) for a while, so the same gif shared again is known
+right away. Probes only connect to public addresses, redirects included.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import re
+import socket
+import time
+import typing
+import urllib.parse
+
+import aiohttp
+
+from .lru import LRUCache
+
+logger = logging.getLogger("MediaClassifier")
+
+GIF = "gif"
+VIDEO = "video"
+OTHER = "other"
+
+EXTENSION_KINDS = {
+    "gif": GIF,
+    "gifv": GIF,
+    "apng": GIF,
+    "mp4": VIDEO,
+    "webm": VIDEO,
+    "mov": VIDEO,
+    "mkv": VIDEO,
+    "m4v": VIDEO,
+}
+
+# subdomains are matched too, e.g. media.tenor.com
+DOMAIN_KINDS = {
+    "tenor.com": GIF,
+    "tenor.co": GIF,
+    "giphy.com": GIF,
+    "gph.is": GIF,
+    "gfycat.com": VIDEO,
+    "redgifs.com": VIDEO,
+    "streamable.com": VIDEO,
+    "klipy.com": GIF,
+    # pages that embed as links, not worth a probe
+    "discord.com": OTHER,
+    "discord.gg": OTHER,
+    "discordapp.com": OTHER,
+    "youtube.com": OTHER,
+    "youtu.be": OTHER,
+    "kurzgesagt.org": OTHER,
+    "wikipedia.org": OTHER,
+    "reddit.com": OTHER,
+    "twitter.com": OTHER,
+    "x.com": OTHER,
+    "github.com": OTHER,
+    "google.com": OTHER,
+}
+
+# links wrapped in <> don't embed, so they are not media
+_URL = re.compile(r"(?<!<)https?://[^\s<>]+")
+
+
+def normalize_url(url: str) -> urllib.parse.SplitResult | None:
+    """
+    Splits a URL with a lowercase host and without credentials and fragment.
+
+    The query is kept, signed and CDN links often tell different files apart only by it.
+    """
+    try:
+        parts = urllib.parse.urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    if not parts.hostname:
+        return None
+    netloc = parts.hostname if port is None else f"{parts.hostname}:{port}"
+    return parts._replace(netloc=netloc, fragment="")
+
+
+def kind_of_path(path: str) -> str | None:
+    name = path.rsplit("/", 1)[-1]
+    if "." not in name:
+        return None
+    return EXTENSION_KINDS.get(name.rsplit(".", 1)[-1].lower())
+
+
+def kind_of_domain(hostname: str) -> str | None:
+    labels = hostname.split(".")
+    for i in range(len(labels) - 1):
+        kind = DOMAIN_KINDS.get(".".join(labels[i:]))
+        if kind is not None:
+            return kind
+    return None
+
+
+def kind_of_content_type(content_type: str | None) -> str:
+    content_type = (content_type or "").split(";", 1)[0].strip().lower()
+    if content_type in ("image/gif", "image/apng"):
+        return GIF
+    if content_type.startswith("video/"):
+        return VIDEO
+    return OTHER
+
+
+def find_links(text: str) -> typing.List[str]:
+    return _URL.findall(text)
+
+
+def is_public_address(host: str) -> bool:
+    """
+    Whether an IP address is publicly routable, anything else is not a probe target.
+    """
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class PublicResolver(aiohttp.abc.AbstractResolver):
+    """
+    Drops every address that is not public, so a link can't point a probe at the bot's own network.
+
+    The connection is made to the filtered addresses, so a host can't resolve to a public
+    address for the check and a private one for the request.
+    """
+
+    def __init__(self):
+        self._resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> typing.List[typing.Dict]:
+        hosts = [h for h in await self._resolver.resolve(host, port, family) if is_public_address(h["host"])]
+        if not hosts:
+            raise OSError(f"{host} has no public address")
+        return hosts
+
+    async def close(self):
+        await self._resolver.close()
+
+
+class MediaClassifier:
+    """
+    Classifies links, with an optional bounded background probe for unknown links and a TTL cache.
+    """
+
+    def __init__(
+        self,
+        probe: bool = False,
+        max_concurrent_probes: int = 4,
+        timeout: float = 2.0,
+        ttl: float = 3600,
+        maxsize: int = 10_000,
+        max_redirects: int = 3,
+    ):
+        self.probe_enabled = probe
+        self.max_concurrent_probes = max_concurrent_probes
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_redirects = max_redirects
+
+        # normalized url -> (kind, monotonic expiry)
+        self._cache: LRUCache[str, typing.Tuple[str, float]] = LRUCache(maxsize)
+        # normalized url -> probe task, shares of a link while it is probed get the same task
+        self._in_flight: typing.Dict[str, asyncio.Task] = {}
+        self._session: aiohttp.ClientSession | None = None
+        self.probed = 0
+        self.cache_hits = 0
+        self.skipped = 0
+
+    def classify(self, url: str) -> str | None:
+        """
+        Classifies a link by its extension or domain, returns None if neither is known.
+        """
+        parts = normalize_url(url)
+        if parts is None:
+            return OTHER
+        kind = kind_of_path(parts.path)
+        if kind is None:
+            kind = kind_of_domain(parts.hostname)  # type: ignore
+        return kind
+
+    def is_media(self, url: str) -> bool:
+        return self.classify(url) in (GIF, VIDEO)
+
+    def classify_link(self, url: str) -> str | asyncio.Future:
+        """
+        Classifies a link without waiting.
+
+        Links with an unknown extension and domain are looked up in the probe cache. If
+        they are not cached either, a future of their background probe is returned, or
+        OTHER if probing is disabled or all probes are busy.
+        """
+        kind = self.classify(url)
+        if kind is not None:
+            return kind
+        if not self.probe_enabled:
+            return OTHER
+
+        key = urllib.parse.urlunsplit(normalize_url(url))  # type: ignore
+        cached = self._cache.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            self.cache_hits += 1
+            return cached[0]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            return asyncio.shield(task)
+        if len(self._in_flight) >= self.max_concurrent_probes:
+            self.skipped += 1
+            return OTHER
+        task = self._in_flight[key] = asyncio.create_task(self._probe(key, url))
+        return asyncio.shield(task)
+
+    async def _probe(self, key: str, url: str) -> str:
+        try:
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(resolver=PublicResolver()),
+                    timeout=aiohttp.ClientTimeout(total=self.timeout),
+                )
+            self.probed += 1
+            kind = await self._request("HEAD", url)
+            if kind is None:
+                # some hosts refuse HEAD, ask for a single byte instead
+                kind = await self._request("GET", url, headers={"Range": "bytes=0-0"})
+            if kind is None:
+                kind = OTHER
+            self._cache.put(key, (kind, time.monotonic() + self.ttl))
+            return kind
+        finally:
+            del self._in_flight[key]
+
+    async def _request(self, method: str, url: str, headers: typing.Dict[str, str] | None = None) -> str | None:
+        """
+        Returns the kind of the content type a request ends at, or None if it fails.
+
+        Redirects are followed here rather than by aiohttp, so every hop is checked.
+        """
+        assert self._session is not None
+        try:
+            for _ in range(self.max_redirects + 1):
+                parts = urllib.parse.urlsplit(url)
+                # literal addresses are connected to without going through the resolver
+                if parts.scheme not in ("http", "https") or not parts.hostname:
+                    return None
+                if is_ip_address(parts.hostname) and not is_public_address(parts.hostname):
+                    return None
+                async with self._session.request(method, url, headers=headers, allow_redirects=False) as response:
+                    if response.status in (301, 302, 303, 307, 308) and "Location" in response.headers:
+                        url = urllib.parse.urljoin(url, response.headers["Location"])
+                        continue
+                    if response.status < 400:
+                        return kind_of_content_type(response.content_type)
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            logger.debug(f"Failed to probe {url}")
+        return None
+
+    async def close(self):
+        for task in list(self._in_flight.values()):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,101 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Cached permission tiers of members.
+
+The tier of a member is computed once from their role ids and kept until their roles
+change, so automod doesn't rebuild role lists on every message. Invalidation is done by
+the automod cog on member updates. Command checks read the roles of the invoker directly,
+a stale tier must never grant a permission.
+"""
+
+import enum
+import typing
+
+from .config import Reference
+from .lru import LRUCache
+
+ADMIN_ROLES = frozenset(Reference.Roles.admin_and_above())
+MODERATOR_ROLES = frozenset(Reference.Roles.moderator_and_above())
+PATREON_ROLES = frozenset(Reference.Roles.patreon())
+# members with these roles are not checked by automod
+AUTOMOD_EXEMPT_ROLES = frozenset(
+    [
+        Reference.Roles.moderator,
+        Reference.Roles.administrator,
+        Reference.Roles.kgsofficial,
+        Reference.Roles.robobird,
+        Reference.Roles.stealthbot,
+    ]
+)
+
+
+class Tier(enum.IntEnum):
+    MEMBER = 0
+    MODERATOR = 1
+    ADMIN = 2
+
+
+class MemberTier(typing.NamedTuple):
+    tier: Tier
+    automod_exempt: bool
+    patreon: bool
+
+
+def compute_tier(member) -> MemberTier:
+    """
+    Computes the tier of a member or user, users outside the guild have no roles.
+    """
+    role_ids = frozenset(role.id for role in getattr(member, "roles", ()))
+    if role_ids & ADMIN_ROLES:
+        tier = Tier.ADMIN
+    elif role_ids & MODERATOR_ROLES:
+        tier = Tier.MODERATOR
+    else:
+        tier = Tier.MEMBER
+    return MemberTier(
+        tier=tier,
+        automod_exempt=member.bot or bool(role_ids & AUTOMOD_EXEMPT_ROLES),
+        patreon=bool(role_ids & PATREON_ROLES),
+    )
+
+
+class TierCache:
+    """
+    Member id -> tier, the least recently used members are dropped past `maxsize`.
+    """
+
+    def __init__(self, maxsize: int = 100_000):
+        self._tiers: LRUCache[int, MemberTier] = LRUCache(maxsize)
+
+    def __len__(self):
+        return len(self._tiers)
+
+    def get(self, member) -> MemberTier:
+        tier = self._tiers.get(member.id)
+        if tier is not None:
+            return tier
+        tier = compute_tier(member)
+        # users outside the guild are not cached, they can show up as members later
+        if hasattr(member, "roles"):
+            self._tiers.put(member.id, tier)
+        return tier
+
+    def invalidate(self, member_id: int):
+        self._tiers.pop(member_id, None)
+
+    def clear(self):
+        self._tiers.clear()
+
+
+member_tiers = TierCache()
@@ -0,0 +1,183 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Recent message history used by the automod spam checks.
+
+Authors and channels are kept in separate namespaces, each key owns a fixed size ring
+buffer of compact records instead of full message objects. Keys that have been idle for
+too long, or the least recently used ones past a hard cap, are evicted.
+"""
+
+import time
+import typing
+from collections import OrderedDict
+
+AUTHOR = "author"
+CHANNEL = "channel"
+
+
+class HistoryRecord(typing.NamedTuple):
+    """
+    Compact form of a message, enough to compare contents, count pings and delete it later.
+    """
+
+    id: int
+    channel_id: int
+    author_id: int
+    content_hash: int
+    timestamp: float
+    mentions: int = 0
+
+
+class _Ring:
+    """
+    Fixed size ring buffer of records with an id -> slot index for in place edits.
+    """
+
+    __slots__ = ("slots", "head", "size", "index", "touched")
+
+    def __init__(self, maxlen: int):
+        self.slots: typing.List[HistoryRecord | None] = [None] * maxlen
+        self.head = 0  # slot the next record is written to
+        self.size = 0
+        self.index: typing.Dict[int, int] = {}
+        self.touched = 0.0
+
+    def __len__(self):
+        return self.size
+
+    def upsert(self, record: HistoryRecord):
+        slot = self.index.get(record.id)
+        if slot is not None:
+            self.slots[slot] = record
+            return
+
+        maxlen = len(self.slots)
+        evicted = self.slots[self.head]
+        if evicted is not None:
+            del self.index[evicted.id]
+        self.slots[self.head] = record
+        self.index[record.id] = self.head
+        self.head = (self.head + 1) % maxlen
+        self.size = min(self.size + 1, maxlen)
+
+    def records(self) -> typing.List[HistoryRecord]:
+        """
+        Returns the records from oldest to newest.
+        """
+        maxlen = len(self.slots)
+        start = (self.head - self.size) % maxlen
+        return [self.slots[(start + i) % maxlen] for i in range(self.size)]  # type: ignore
+
+    def pop_oldest(self, count: int) -> typing.List[HistoryRecord]:
+        records = self.records()[:count]
+        maxlen = len(self.slots)
+        start = (self.head - self.size) % maxlen
+        for i in range(len(records)):
+            self.slots[(start + i) % maxlen] = None
+            del self.index[records[i].id]
+        self.size -= len(records)
+        return records
+
+
+class MessageHistory:
+    """
+    Per author and per channel ring buffers of the most recent messages.
+    """
+
+    def __init__(
+        self,
+        author_size: int = 5,
+        channel_size: int = 10,
+        ttl: float = 3600,
+        max_keys: int = 50_000,
+    ):
+        self.sizes = {AUTHOR: author_size, CHANNEL: channel_size}
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # least recently touched first
+        self._rings: typing.Dict[str, OrderedDict[int, _Ring]] = {AUTHOR: OrderedDict(), CHANNEL: OrderedDict()}
+        self.evictions = 0
+
+    def __len__(self):
+        return sum(len(rings) for rings in self._rings.values())
+
+    def _touch(self, namespace: str, key: int, now: float) -> _Ring:
+        rings = self._rings[namespace]
+        ring = rings.get(key)
+        if ring is None:
+            ring = rings[key] = _Ring(self.sizes[namespace])
+        else:
+            rings.move_to_end(key)
+        ring.touched = now
+        return ring
+
+    def add(self, message) -> HistoryRecord:
+        """
+        Records a message, an edited message replaces its earlier record.
+        """
+        now = time.monotonic()
+        # users and roles pinged in the text, reply pings are not counted
+        mentions = len(set(message.raw_mentions)) + len(set(message.raw_role_mentions))
+        record = HistoryRecord(message.id, message.channel.id, message.author.id, hash(message.content), now, mentions)
+        self._touch(AUTHOR, record.author_id, now).upsert(record)
+        self._touch(CHANNEL, record.channel_id, now).upsert(record)
+        self.evict(now)
+        return record
+
+    def records(self, namespace: str, key: int) -> typing.List[HistoryRecord]:
+        """
+        Returns the records of an author or channel from oldest to newest.
+        """
+        ring = self._rings[namespace].get(key)
+        return ring.records() if ring is not None else []
+
+    def mentions(self, author_id: int, window: float, now: float | None = None) -> int:
+        """
+        Counts the pings in the recent messages of an author within the window.
+        """
+        if now is None:
+            now = time.monotonic()
+        return sum(r.mentions for r in self.records(AUTHOR, author_id) if now - r.timestamp <= window)
+
+    def forgive_mentions(self, author_id: int):
+        """
+        Clears the pings of the recent messages of an author, after they were dealt with.
+        """
+        ring = self._rings[AUTHOR].get(author_id)
+        if ring is None:
+            return
+        for record in ring.records():
+            if record.mentions:
+                ring.upsert(record._replace(mentions=0))
+
+    def pop_oldest(self, namespace: str, key: int, count: int) -> typing.List[HistoryRecord]:
+        """
+        Removes and returns the oldest records of an author or channel.
+        """
+        ring = self._rings[namespace].get(key)
+        return ring.pop_oldest(count) if ring is not None else []
+
+    def evict(self, now: float | None = None):
+        """
+        Drops keys that have been idle longer than the ttl and the least recently used past the cap.
+        """
+        if now is None:
+            now = time.monotonic()
+        for rings in self._rings.values():
+            while rings:
+                key, ring = next(iter(rings.items()))
+                if now - ring.touched <= self.ttl and len(rings) <= self.max_keys:
+                    break
+                del rings[key]
+                self.evictions += 1
@@ -0,0 +1,203 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Near duplicate detection for copypasta raids.
+
+Normalized messages are fingerprinted with MinHash over character shingles. Similar
+messages are grouped into clusters through a locality sensitive hash index, so a lookup
+only compares against the few clusters that share a band with the message. Messages
+leave their cluster once they are older than the window.
+"""
+
+import time
+import typing
+from collections import Counter, deque
+
+import numpy as np
+
+from .message_history import HistoryRecord
+
+SHINGLE_SIZE = 4
+# 64 hash functions split into 16 bands of 4 rows
+PERMUTATIONS = 64
+BANDS = 16
+ROWS = PERMUTATIONS // BANDS
+# only the start of long messages is fingerprinted
+MAX_LENGTH = 1024
+
+_random = np.random.default_rng(0x6B7A)
+_MULTIPLIERS = _random.integers(1, 2**63, size=PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_INCREMENTS = _random.integers(0, 2**63, size=PERMUTATIONS, dtype=np.uint64)
+
+
+def minhash(text: str) -> np.ndarray | None:
+    """
+    Returns the MinHash signature of the text, or None if it is too short to compare.
+    """
+    text = " ".join(text[:MAX_LENGTH].split())
+    count = len(text) - SHINGLE_SIZE + 1
+    if count < 1:
+        return None
+    shingles = np.fromiter((hash(text[i : i + SHINGLE_SIZE]) for i in range(count)), dtype=np.int64, count=count).view(
+        np.uint64
+    )
+    # every row is a different hash of all shingles, wrapping around at 64 bits
+    hashed = np.outer(_MULTIPLIERS, shingles) + _INCREMENTS[:, None]
+    return hashed.min(axis=1)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Estimates the jaccard similarity of two signatures.
+    """
+    return np.count_nonzero(a == b) / PERMUTATIONS
+
+
+def _bands(signature: np.ndarray) -> typing.List[typing.Tuple[int, bytes]]:
+    return [(i, signature[i * ROWS : (i + 1) * ROWS].tobytes()) for i in range(BANDS)]
+
+
+class _Cluster:
+    __slots__ = ("signature", "bands", "size", "authors", "records", "flagged")
+
+    def __init__(self, signature: np.ndarray):
+        self.signature = signature
+        self.bands = _bands(signature)
+        self.size = 0
+        self.authors: typing.Counter[int] = Counter()
+        # messages still within the window, oldest first
+        self.records: typing.List[HistoryRecord] = []
+        self.flagged = False
+
+
+class CopypastaHit(typing.NamedTuple):
+    """
+    Messages of a cluster at the moment it is flagged, for moderators to review.
+    """
+
+    records: typing.List[HistoryRecord]
+    authors: int
+
+
+class NearDuplicateIndex:
+    """
+    Time windowed index that flags clusters of similar messages from several accounts.
+
+    A cluster is flagged once it holds `min_messages` messages from at least
+    `min_authors` authors within `window` seconds. Flagging only reports the cluster,
+    near duplicates are common in busy chats (greetings, quoted announcements, memes),
+    so nothing is removed because of it.
+    """
+
+    def __init__(
+        self,
+        window: float = 60,
+        min_messages: int = 8,
+        min_authors: int = 4,
+        threshold: float = 0.8,
+        min_length: int = 30,
+        max_entries: int = 10_000,
+    ):
+        self.window = window
+        self.min_messages = min_messages
+        self.min_authors = min_authors
+        self.threshold = threshold
+        self.min_length = min_length
+        self.max_entries = max_entries
+
+        self._clusters: typing.Dict[int, _Cluster] = {}
+        self._buckets: typing.Dict[typing.Tuple[int, bytes], typing.Set[int]] = {}
+        # (record, cluster id) in arrival order
+        self._entries: typing.Deque[typing.Tuple[HistoryRecord, int]] = deque()
+        self._seen: typing.Set[int] = set()
+        self._next_id = 0
+        self.flagged = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def clusters(self) -> int:
+        return len(self._clusters)
+
+    def add(self, record: HistoryRecord, text: str) -> CopypastaHit | None:
+        """
+        Adds a normalized message, returns its cluster the first time the cluster is flagged.
+        """
+        self.expire(record.timestamp)
+        # edits are not counted again
+        if len(text) < self.min_length or record.id in self._seen:
+            return None
+        signature = minhash(text)
+        if signature is None:
+            return None
+
+        cluster_id = self._find(signature)
+        if cluster_id is None:
+            cluster_id = self._next_id
+            self._next_id += 1
+            cluster = self._clusters[cluster_id] = _Cluster(signature)
+            for band in cluster.bands:
+                self._buckets.setdefault(band, set()).add(cluster_id)
+        cluster = self._clusters[cluster_id]
+
+        cluster.size += 1
+        cluster.authors[record.author_id] += 1
+        cluster.records.append(record)
+        self._entries.append((record, cluster_id))
+        self._seen.add(record.id)
+
+        if cluster.flagged or cluster.size < self.min_messages or len(cluster.authors) < self.min_authors:
+            return None
+        cluster.flagged = True
+        self.flagged += 1
+        return CopypastaHit(list(cluster.records), len(cluster.authors))
+
+    def _find(self, signature: np.ndarray) -> int | None:
+        best = None
+        best_similarity = self.threshold
+        checked = set()
+        for band in _bands(signature):
+            for cluster_id in self._buckets.get(band, ()):
+                if cluster_id in checked:
+                    continue
+                checked.add(cluster_id)
+                score = similarity(signature, self._clusters[cluster_id].signature)
+                if score >= best_similarity:
+                    best, best_similarity = cluster_id, score
+        return best
+
+    def expire(self, now: float | None = None):
+        """
+        Drops messages older than the window, and the oldest ones past the cap.
+        """
+        if now is None:
+            now = time.monotonic()
+        entries = self._entries
+        while entries and (now - entries[0][0].timestamp > self.window or len(entries) >= self.max_entries):
+            record, cluster_id = entries.popleft()
+            self._seen.discard(record.id)
+            cluster = self._clusters[cluster_id]
+            cluster.size -= 1
+            cluster.authors[record.author_id] -= 1
+            if not cluster.authors[record.author_id]:
+                del cluster.authors[record.author_id]
+            if cluster.records and cluster.records[0] is record:
+                cluster.records.pop(0)
+            if not cluster.size:
+                del self._clusters[cluster_id]
+                for band in cluster.bands:
+                    bucket = self._buckets[band]
+                    bucket.discard(cluster_id)
+                    if not bucket:
+                        del self._buckets[band]
@@ -0,0 +1,216 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Guild wide sweep that applies the nickname rules to every cached member.
+
+Members are visited in id order in chunks, yielding to the event loop between chunks.
+Nickname edits go through a bounded queue that a single worker drains at a fixed pace,
+so the sweep never competes with moderation for the rate limit. The id up to which every
+member has been handled is saved as a checkpoint, a stopped or crashed sweep resumes there.
+The time the last sweep finished is kept in the same document, so a schedule can survive
+restarts.
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+import typing
+from collections import deque
+
+import discord
+
+from .nicknames import NicknameFix
+
+logger = logging.getLogger("NicknameSweep")
+
+
+class NicknameSweep:
+    """
+    Resumable, rate limited nickname sweep over the member cache of a guild.
+    """
+
+    def __init__(
+        self,
+        evaluate: typing.Callable[[discord.Member], NicknameFix | None],
+        checkpoints,
+        chunk_size: int = 1000,
+        edit_interval: float = 1.0,
+        max_pending: int = 100,
+        on_done: typing.Callable[[discord.Member, bool], None] | None = None,
+    ):
+        self.evaluate = evaluate
+        # called once for every fix evaluate returned, with whether the member was renamed.
+        # fixes dropped by a stop or crash before their edit ran count as not renamed
+        self.on_done = on_done
+        self.checkpoints = checkpoints
+        self.chunk_size = chunk_size
+        self.edit_interval = edit_interval
+        self.max_pending = max_pending
+
+        self._task: asyncio.Task | None = None
+        self._queue: asyncio.Queue[typing.Tuple[discord.Member, NicknameFix] | None] = asyncio.Queue(max_pending)
+        # ids of the members that are queued or being edited, in id order
+        self._pending: typing.Deque[int] = deque()
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.scanned = 0
+        self.edited = 0
+        self.failed = 0
+        self.started_at = 0.0
+        self.finished = False
+        self.resumed_from: int | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, guild: discord.Guild, on_finish: typing.Callable[[str], None] | None = None) -> bool:
+        """
+        Starts or resumes a sweep, returns False if one is already running.
+        """
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self._run(guild, on_finish))
+        return True
+
+    def stop(self) -> bool:
+        """
+        Stops the sweep, the checkpoint is kept so the next start resumes it.
+        """
+        if not self.running:
+            return False
+        self._task.cancel()  # type: ignore
+        return True
+
+    async def last_finished(self, guild_id: int) -> datetime.datetime | None:
+        """
+        Returns when the last sweep of the guild finished, as naive UTC, or None if none has.
+        """
+        document = await asyncio.to_thread(self.checkpoints.find_one, {"_id": guild_id})
+        return document.get("finished") if document else None
+
+    def status(self) -> str:
+        if not self.started_at:
+            return "No nickname sweep has run yet."
+        elapsed = time.monotonic() - self.started_at
+        rate = self.scanned / elapsed if elapsed else 0
+        return (
+            f"{'Finished' if self.finished else 'Running' if self.running else 'Stopped'}"
+            f"{f' (resumed after {self.resumed_from})' if self.resumed_from else ''}\n"
+            f"Scanned: {self.scanned}/{self.total} members ({rate:.0f}/s)\n"
+            f"Renamed: {self.edited}\nFailed: {self.failed}\nQueued edits: {len(self._pending)}"
+        )
+
+    async def _run(self, guild: discord.Guild, on_finish: typing.Callable[[str], None] | None):
+        self._reset()
+        self.started_at = time.monotonic()
+        checkpoint = await asyncio.to_thread(self.checkpoints.find_one, {"_id": guild.id})
+        self.resumed_from = checkpoint.get("last_id") if checkpoint else None
+
+        # sorted a chunk at a time and merged lazily, so a large guild doesn't hold up the loop
+        members = guild.members
+        chunks = []
+        for start in range(0, len(members), self.chunk_size):
+            chunk = sorted(
+                member.id
+                for member in members[start : start + self.chunk_size]
+                if self.resumed_from is None or member.id > self.resumed_from
+            )
+            chunks.append(chunk)
+            self.total += len(chunk)
+            await asyncio.sleep(0)
+        member_ids = heapq.merge(*chunks)
+
+        self._queue = asyncio.Queue(self.max_pending)
+        self._pending.clear()
+        worker = asyncio.create_task(self._edit_worker())
+        try:
+            while chunk := list(itertools.islice(member_ids, self.chunk_size)):
+                for member_id in chunk:
+                    member = guild.get_member(member_id)
+                    # left the guild or can't be edited by the bot
+                    if member is None or member.bot or member.top_role >= guild.me.top_role:
+                        continue
+                    fix = self.evaluate(member)
+                    if fix is not None:
+                        self._pending.append(member_id)
+                        try:
+                            # waits while the queue is full, so the scan never runs far ahead of the edits
+                            await self._queue.put((member, fix))
+                        except asyncio.CancelledError:
+                            self._pending.pop()
+                            self._done(member, False)
+                            raise
+                self.scanned += len(chunk)
+                await self._save_checkpoint(guild.id, self._pending[0] - 1 if self._pending else chunk[-1])
+                await asyncio.sleep(0)
+
+            await self._queue.put(None)
+            await worker
+            await asyncio.to_thread(
+                self.checkpoints.update_one,
+                {"_id": guild.id},
+                {"$set": {"finished": datetime.datetime.utcnow()}, "$unset": {"last_id": ""}},
+                upsert=True,
+            )
+            self.finished = True
+            logger.info(f"Nickname sweep finished, {self.edited} renamed")
+            if on_finish is not None:
+                on_finish(self.status())
+        except Exception:
+            logger.exception("Nickname sweep failed")
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+            # edits that never ran are handed back, so those members are checked again
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    self._pending.pop()
+                    self._done(item[0], False)
+
+    async def _save_checkpoint(self, guild_id: int, last_id: int):
+        try:
+            await asyncio.to_thread(
+                self.checkpoints.update_one,
+                {"_id": guild_id},
+                {"$set": {"last_id": last_id, "updated": datetime.datetime.utcnow()}},
+                upsert=True,
+            )
+        except Exception:
+            logger.exception("Failed to save nickname sweep checkpoint")
+
+    async def _edit_worker(self):
+        while (item := await self._queue.get()) is not None:
+            member, fix = item
+            renamed = False
+            try:
+                await member.edit(nick=fix.nick, reason=f"Nickname sweep: {fix.reason}")
+                self.edited += 1
+                renamed = True
+            except discord.HTTPException:
+                self.failed += 1
+            finally:
+                # also runs when the sweep is stopped mid edit
+                self._pending.popleft()
+                self._done(member, renamed)
+            await asyncio.sleep(self.edit_interval)
+
+    def _done(self, member: discord.Member, renamed: bool):
+        if self.on_done is not None:
+            self.on_done(member, renamed)
@@ -0,0 +1,63 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Nickname rules enforced by automod.
+"""
+
+import re
+import typing
+
+LOCKED_NICKNAME = "Kurzgesagt Fan"
+BANNED_WORDS = ("nazi", "hitler", "führer", "fuhrer")
+
+# a name needs three typeable characters in a row to be pingable
+_PINGABLE = re.compile(r"[a-zA-Z0-9~!@#$%^&*()_+`;':\",./<>?]{3,}", re.IGNORECASE)
+
+
+class NicknameFix(typing.NamedTuple):
+    """
+    Nickname a member should get, None resets it to the username.
+    """
+
+    nick: str | None
+    reason: str
+
+
+def is_pingable(name: str) -> bool:
+    return _PINGABLE.search(name) is not None
+
+
+def has_banned_word(name: str) -> bool:
+    return any(word in name for word in BANNED_WORDS)
+
+
+def nickname_fix(name: str, nick: str | None, locked: bool) -> NicknameFix | None:
+    """
+    Returns the nickname change a member needs, or None if their names follow the rules.
+    """
+    if locked:
+        if nick != LOCKED_NICKNAME:
+            return NicknameFix(LOCKED_NICKNAME, "Nickname Lock")
+        return None
+
+    if nick is None:
+        if has_banned_word(name):
+            return NicknameFix("Parrot", "Banned word in username")
+        if not is_pingable(name):
+            return NicknameFix("Unpingable Username", "Unpingable username")
+    else:
+        if has_banned_word(nick):
+            return NicknameFix(None, "Banned word in nickname")
+        if not is_pingable(nick):
+            return NicknameFix("Unpingable Nickname", "Unpingable nickname")
+    return None
@@ -0,0 +1,139 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Token bucket rate limiting for the automod flood check.
+
+Every key only stores its remaining tokens and the time they were last updated. A full
+bucket is the same as no bucket, so idle keys are dropped by `sweep` once they have
+refilled and memory only grows with the number of active users.
+"""
+
+import time
+import typing
+
+USER = "user"
+CHANNEL = "channel"
+
+
+class RateLimit(typing.NamedTuple):
+    """
+    At most `rate` messages every `per` seconds.
+    """
+
+    rate: int
+    per: float
+
+
+class TokenBuckets:
+    """
+    Token buckets of many keys that share one limit.
+    """
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.capacity = float(limit.rate)
+        self.fill_rate = limit.rate / limit.per
+        # key -> (tokens, monotonic time of the last update)
+        self._buckets: typing.Dict[int, typing.Tuple[float, float]] = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key: int, now: float) -> bool:
+        """
+        Takes a token, returns False if the bucket is empty.
+        """
+        tokens, last = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - last) * self.fill_rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return False
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def sweep(self, now: float) -> int:
+        """
+        Drops the buckets that have refilled, returns how many were dropped.
+        """
+        full = [
+            key
+            for key, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * self.fill_rate >= self.capacity
+        ]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
+
+
+class Flood(typing.NamedTuple):
+    """
+    A rate limit that was hit, strikes count the hits since the scope was last quiet.
+    """
+
+    scope: str
+    strikes: int
+
+
+class FloodLimiter:
+    """
+    Per user and per channel flood limits of a channel profile.
+
+    Every hit adds a strike to the user or channel, strikes are forgotten after
+    `strike_ttl` seconds without a hit.
+    """
+
+    def __init__(self, user: RateLimit, channel: RateLimit, strike_ttl: float = 300):
+        self.users = TokenBuckets(user)
+        self.channels = TokenBuckets(channel)
+        self.strike_ttl = strike_ttl
+        # (scope, id) -> (strikes, monotonic time of the last strike)
+        self._strikes: typing.Dict[typing.Tuple[str, int], typing.Tuple[int, float]] = {}
+
+    def __len__(self):
+        return len(self.users) + len(self.channels)
+
+    def check(self, author_id: int, channel_id: int, now: float | None = None) -> Flood | None:
+        """
+        Counts a message, returns the limit it hit if any.
+        """
+        if now is None:
+            now = time.monotonic()
+        if not self.users.take(author_id, now):
+            return Flood(USER, self._strike((USER, author_id), now))
+        if not self.channels.take(channel_id, now):
+            return Flood(CHANNEL, self._strike((CHANNEL, channel_id), now))
+        return None
+
+    def _strike(self, key: typing.Tuple[str, int], now: float) -> int:
+        strikes, last = self._strikes.get(key, (0, now))
+        if now - last > self.strike_ttl:
+            strikes = 0
+        self._strikes[key] = (strikes + 1, now)
+        return strikes + 1
+
+    def forgive(self, scope: str, id: int):
+        """
+        Clears the strikes of a user or channel, after it was dealt with.
+        """
+        self._strikes.pop((scope, id), None)
+
+    def sweep(self, now: float | None = None) -> int:
+        """
+        Drops idle buckets and expired strikes, returns how many buckets were dropped.
+        """
+        if now is None:
+            now = time.monotonic()
+        expired = [key for key, (_, last) in self._strikes.items() if now - last > self.strike_ttl]
+        for key in expired:
+            del self._strikes[key]
+        return self.users.sweep(now) + self.channels.sweep(now)
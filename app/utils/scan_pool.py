@@ -0,0 +1,146 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Process pool for the CPU heavy automod scans.
+
+Long messages are scanned in worker processes so a burst of them can't stall the event loop.
+Every worker compiles the filter lists once when it starts, so only the message text is sent
+per scan. Short messages are cheaper to scan in the event loop than to send to a worker.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+from .filter_matcher import FilterMatcher, PatternBundle, Whitelist, resolve_profanity
+
+logger = logging.getLogger("ScanPool")
+
+# profile name -> (version, words), as sent to the workers
+Profiles = typing.Dict[str, typing.Tuple[typing.Tuple[int, ...], typing.List[str]]]
+
+# state of a worker process, set up by _init_worker
+_matchers: typing.Dict[str, typing.Tuple[typing.Tuple[int, ...], FilterMatcher]] = {}
+_whitelist = Whitelist(())
+
+
+def _init_worker(profiles: Profiles, white_list: typing.List[str]):
+    global _whitelist
+    for name, (version, words) in profiles.items():
+        _matchers[name] = (version, FilterMatcher([PatternBundle(name, words)]))
+    _whitelist = Whitelist(white_list)
+
+
+def _warm_up():
+    return True
+
+
+def find_profanity(profile: str, version: typing.Tuple[int, ...], message_clean: str):
+    """
+    Runs the filter of a profile on normalized text inside a worker.
+
+    Returns None if the worker was started with another version of the lists.
+    """
+    worker_version, matcher = _matchers[profile]
+    if worker_version != version:
+        return None
+    return resolve_profanity(matcher.find(message_clean), _whitelist, message_clean)
+
+
+class ScanPool:
+    """
+    Optional process pool with a bounded number of pending scans.
+
+    When the pool is saturated scans are not queued. A scan that is not queued, fails or
+    is refused by a worker is shed: `run` returns None and the caller scans the text in
+    pieces of at most `min_length` characters instead, yielding to the loop between them.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32, min_length: int = 500):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.min_length = min_length
+
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending = 0
+        self.offloaded = 0
+        self.shed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self, profiles: Profiles, white_list: typing.List[str]):
+        """
+        Starts the workers, they compile the lists in the background.
+        """
+        self.stop()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(profiles, white_list),
+        )
+        # spawn every worker up front so the lists are compiled before the first scan
+        for _ in range(self.max_workers):
+            self._executor.submit(_warm_up)
+        logger.info(f"Started scan pool with {self.max_workers} workers")
+
+    def reload(self, profiles: Profiles, white_list: typing.List[str]):
+        """
+        Restarts the workers with new lists if the pool is running.
+        """
+        if self.running:
+            self.start(profiles, white_list)
+
+    def stop(self):
+        if self._executor is None:
+            return
+        # scans that are already queued still finish in the old workers
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def offloads(self, text: str) -> bool:
+        """
+        Whether a scan of the text should go to the pool.
+        """
+        return self._executor is not None and len(text) >= self.min_length
+
+    async def run(self, fn: typing.Callable, *args) -> typing.Any:
+        """
+        Runs a scan in the pool, returns None if the pool is not running or the scan was shed.
+        """
+        if self._executor is None:
+            return None
+        if self._pending >= self.max_pending:
+            self.shed += 1
+            return None
+
+        self._pending += 1
+        self.offloaded += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except Exception:
+            logger.exception("Scan failed in pool")
+            result = None
+        finally:
+            self._pending -= 1
+        if result is None:
+            self.shed += 1
+        return result
@@ -0,0 +1,227 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Shadow evaluation of staged filter list changes.
+
+Changes are staged on top of the live lists and compiled into candidate matchers. A
+sample of the filtered messages is queued and scanned with both the live and the
+candidate matcher by a background worker, after the live filter already acted on the
+message. Messages the two disagree on and the time the candidate adds to a scan are kept
+in a bounded report, so a change can be reviewed before it is promoted.
+
+The scans still share the interpreter with the event loop, so the sample rate and the
+bounded queue are what limit their cost. The scan times in the report show a slow
+candidate before it goes live.
+"""
+
+import asyncio
+import datetime
+import logging
+import random
+import time
+import typing
+from collections import deque
+
+import discord
+
+from .filter_matcher import FilterMatcher, PatternBundle, Whitelist, resolve_profanity
+from .text_normalizer import normalize
+
+logger = logging.getLogger("ShadowFilter")
+
+
+class ShadowHit(typing.NamedTuple):
+    """
+    A message the candidate would have handled differently.
+
+    New hits are flagged by the candidate only, cleared hits by the live lists only.
+    """
+
+    timestamp: datetime.datetime
+    profile: str
+    jump_url: str
+    content: str
+    words: typing.List[str]
+    new: bool
+
+
+class _Sample(typing.NamedTuple):
+    revision: int
+    profile: str
+    live: FilterMatcher
+    candidate: FilterMatcher
+    whitelist: Whitelist
+    content: str
+    jump_url: str
+
+
+def _percentile(values: typing.Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ShadowFilter:
+    """
+    Staged list changes, their candidate matchers and the report of their evaluation.
+    """
+
+    def __init__(self, sample_rate: float = 0.1, max_hits: int = 100, max_samples: int = 1000, maxsize: int = 256):
+        self.sample_rate = sample_rate
+        self.max_hits = max_hits
+        self.max_samples = max_samples
+
+        # list type -> word -> whether it is added or removed
+        self.changes: typing.Dict[str, typing.Dict[str, bool]] = {}
+        # bumped on every staged change, so a stale compile is not applied
+        self.revision = 0
+        # profile name -> candidate matcher
+        self.matchers: typing.Dict[str, FilterMatcher] = {}
+
+        self._queue: asyncio.Queue[_Sample] = asyncio.Queue(maxsize)
+        self._worker: asyncio.Task | None = None
+        self._reset_report()
+
+    def _reset_report(self):
+        self.started_at = discord.utils.utcnow()
+        self.hits: typing.Deque[ShadowHit] = deque(maxlen=self.max_hits)
+        # seconds of the candidate scans and what they add over the live scans
+        self.timings: typing.Deque[float] = deque(maxlen=self.max_samples)
+        self.added: typing.Deque[float] = deque(maxlen=self.max_samples)
+        self.sampled = 0
+        self.evaluated = 0
+        self.dropped = 0
+        self.failed = 0
+        self.new_hits = 0
+        self.cleared_hits = 0
+
+    @property
+    def active(self) -> bool:
+        return bool(self.matchers)
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._work())
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def stage(self, list_type: str, word: str, add: bool):
+        self.changes.setdefault(list_type, {})[word] = add
+        # nothing is sampled until the changes are compiled
+        self.matchers = {}
+        self.revision += 1
+        self._reset_report()
+
+    def discard(self):
+        self.changes.clear()
+        self.matchers = {}
+        self.revision += 1
+        self._reset_report()
+
+    def candidate_bundles(self, bundles: typing.Dict[str, PatternBundle]) -> typing.Dict[str, PatternBundle]:
+        """
+        Applies the staged changes to the live bundles.
+        """
+        bundles = dict(bundles)
+        for list_type, words in self.changes.items():
+            bundle = bundles[list_type]
+            for word, add in words.items():
+                if add and word not in bundle.words:
+                    bundle = bundle.add(word)
+                elif not add and word in bundle.words:
+                    bundle = bundle.remove(word)
+            bundles[list_type] = bundle
+        return bundles
+
+    def offer(self, profile: str, live: FilterMatcher, whitelist: Whitelist, content: str, jump_url: str):
+        """
+        Queues a message for evaluation if it is sampled, never waits.
+        """
+        candidate = self.matchers.get(profile)
+        if candidate is None or random.random() >= self.sample_rate:
+            return
+        self.sampled += 1
+        if self._queue.full():
+            self.dropped += 1
+            return
+        self._queue.put_nowait(_Sample(self.revision, profile, live, candidate, whitelist, content, jump_url))
+
+    @staticmethod
+    def evaluate(sample: _Sample):
+        """
+        Scans a sample with both matchers, returns both verdicts and scan times.
+        """
+        message_clean = normalize(sample.content).text
+        start = time.perf_counter()
+        live = resolve_profanity(sample.live.find(message_clean), sample.whitelist, message_clean)
+        live_time = time.perf_counter() - start
+        start = time.perf_counter()
+        candidate = resolve_profanity(sample.candidate.find(message_clean), sample.whitelist, message_clean)
+        candidate_time = time.perf_counter() - start
+        return live, candidate, live_time, candidate_time
+
+    async def _work(self):
+        while True:
+            sample = await self._queue.get()
+            try:
+                # re holds the GIL for a whole match, so the thread only lets the loop run between the
+                # two scans, a slow candidate pattern still stalls it while it matches
+                live, candidate, live_time, candidate_time = await asyncio.to_thread(self.evaluate, sample)
+            except Exception:
+                logger.exception("Failed to evaluate candidate filter")
+                self.failed += 1
+                continue
+            # the changes were edited since the sample was taken
+            if sample.revision != self.revision:
+                continue
+
+            self.evaluated += 1
+            self.timings.append(candidate_time)
+            self.added.append(candidate_time - live_time)
+            if bool(live) == bool(candidate):
+                continue
+            if candidate:
+                self.new_hits += 1
+            else:
+                self.cleared_hits += 1
+            self.hits.append(
+                ShadowHit(
+                    timestamp=discord.utils.utcnow(),
+                    profile=sample.profile,
+                    jump_url=sample.jump_url,
+                    content=sample.content[:200],
+                    words=list(candidate or live),  # type: ignore
+                    new=bool(candidate),
+                )
+            )
+
+    def report(self) -> str:
+        if not self.changes:
+            return "No candidate changes are staged."
+        changes = "\n".join(
+            f"{'+' if add else '-'} {list_type}: {word}"
+            for list_type, words in self.changes.items()
+            for word, add in words.items()
+        )
+        return (
+            f"{changes}\n\n"
+            f"Evaluating since {discord.utils.format_dt(self.started_at, 'R')}, sampling {self.sample_rate:.0%} of messages\n"
+            f"Evaluated: {self.evaluated}/{self.sampled} (dropped {self.dropped}, failed {self.failed})\n"
+            f"New hits: {self.new_hits}\nCleared hits: {self.cleared_hits}\n"
+            f"Candidate scan p50/p99: {_percentile(self.timings, 0.5) * 1000:.3f}/{_percentile(self.timings, 0.99) * 1000:.3f}ms\n"
+            f"Added latency p50/p99: {_percentile(self.added, 0.5) * 1000:+.3f}/{_percentile(self.added, 0.99) * 1000:+.3f}ms"
+        )
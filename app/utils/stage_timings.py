@@ -0,0 +1,140 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Latency histograms of the stages of the automod pipeline.
+
+Every stage has a histogram with fixed buckets, so recording a timing is a bisect and an
+increment and memory does not grow with traffic. Stages are timed with a `start` and `stop`
+pair instead of a context manager, so while timing is disabled a hook costs two calls that
+return right away.
+"""
+
+import bisect
+import time
+import typing
+
+# upper bounds of the buckets in microseconds, anything slower lands in the last bucket
+BUCKETS_US = (
+    1,
+    2,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1_000,
+    2_500,
+    5_000,
+    10_000,
+    25_000,
+    50_000,
+    100_000,
+    250_000,
+    1_000_000,
+)
+
+
+class Histogram:
+    """
+    Counts of timings per bucket, with their total and maximum.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds: typing.Sequence[int]):
+        # in nanoseconds
+        self.bounds = [bound * 1000 for bound in bounds]
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns: int):
+        self.counts[bisect.bisect_left(self.bounds, ns)] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, q: float) -> float:
+        """
+        Returns the upper bound of the bucket the percentile falls in, in microseconds.
+        """
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                # the overflow bucket has no bound, the maximum is the best estimate
+                return min(self.bounds[i], self.max) / 1000 if i < len(self.bounds) else self.max / 1000
+        return 0.0
+
+
+class StageTimings:
+    """
+    Stage name -> histogram, the stages are created on first use.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: typing.Sequence[int] = BUCKETS_US):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.histograms: typing.Dict[str, Histogram] = {}
+
+    def start(self) -> int:
+        """
+        Returns the start time of a stage, or 0 while timing is disabled.
+        """
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def stop(self, name: str, start: int):
+        """
+        Records a stage that began at `start`, stages started while disabled are skipped.
+        """
+        if not start:
+            return
+        ns = time.perf_counter_ns() - start
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.buckets)
+        histogram.record(ns)
+
+    def reset(self):
+        self.histograms.clear()
+
+    def summary(self) -> str:
+        """
+        Table of the count, mean, p50, p99 and maximum of every stage in microseconds.
+        """
+        if not self.histograms:
+            return "No timings recorded."
+        lines = [f"{'stage':<18}{'count':>8}{'mean':>9}{'p50':>9}{'p99':>9}{'max':>10}"]
+        for name, h in sorted(self.histograms.items()):
+            lines.append(
+                f"{name:<18}{h.count:>8}{h.total / h.count / 1000:>9.0f}"
+                f"{h.percentile(0.5):>9.0f}{h.percentile(0.99):>9.0f}{h.max / 1000:>10.0f}"
+            )
+        return "\n".join(lines)
+
+    def dump(self) -> str:
+        """
+        Bucket counts of every stage, one line per bucket.
+        """
+        lines = []
+        for name, h in sorted(self.histograms.items()):
+            lines.append(f"{name} ({h.count} timings)")
+            for i, count in enumerate(h.counts):
+                bound = f"<= {self.buckets[i]}us" if i < len(self.buckets) else f"> {self.buckets[-1]}us"
+                lines.append(f"  {bound:>14} {count}")
+        return "\n".join(lines)
@@ -0,0 +1,300 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Text normalization for the automod filter.
+
+Messages are folded into lowercase ascii before they are matched against the filter lists:
+- regional indicators, Cyrillic/Greek homoglyphs and other confusables become ascii letters
+- compatibility forms (fullwidth, superscripts, math letters, accents) are folded like NFKC
+- zero width characters and combining marks are dropped
+- everything else that is not ascii becomes `*`, which the filter treats as a wildcard
+- markdown delimiters and custom emoji are stripped
+
+Every character goes through a single `str.translate` table which keeps indexes intact.
+The few characters that are dropped or expand, markdown and custom emoji are then spliced
+in one pass, keeping an offset map back to the original text for every change.
+"""
+
+import bisect
+import re
+import typing
+import unicodedata
+
+# letters that look like ascii letters but do not decompose to them
+HOMOGLYPHS = {
+    # Cyrillic
+    "а": "a",
+    "в": "b",
+    "с": "c",
+    "ԁ": "d",
+    "е": "e",
+    "ё": "e",
+    "ɡ": "g",
+    "н": "h",
+    "һ": "h",
+    "і": "i",
+    "ї": "i",
+    "ј": "j",
+    "к": "k",
+    "ӏ": "l",
+    "м": "m",
+    "и": "n",
+    "о": "o",
+    "р": "p",
+    "ԛ": "q",
+    "ѕ": "s",
+    "т": "t",
+    "ѵ": "v",
+    "ш": "w",
+    "ԝ": "w",
+    "х": "x",
+    "у": "y",
+    "ү": "y",
+    # Greek
+    "α": "a",
+    "β": "b",
+    "ε": "e",
+    "η": "n",
+    "ι": "i",
+    "κ": "k",
+    "μ": "u",
+    "ν": "v",
+    "ο": "o",
+    "ρ": "p",
+    "τ": "t",
+    "υ": "u",
+    "χ": "x",
+    "ω": "w",
+    "γ": "y",
+    # small capitals
+    "ᴀ": "a",
+    "ʙ": "b",
+    "ᴄ": "c",
+    "ᴅ": "d",
+    "ᴇ": "e",
+    "ꜰ": "f",
+    "ɢ": "g",
+    "ʜ": "h",
+    "ɪ": "i",
+    "ᴊ": "j",
+    "ᴋ": "k",
+    "ʟ": "l",
+    "ᴍ": "m",
+    "ɴ": "n",
+    "ᴏ": "o",
+    "ᴘ": "p",
+    "ʀ": "r",
+    "ꜱ": "s",
+    "ᴛ": "t",
+    "ᴜ": "u",
+    "ᴠ": "v",
+    "ᴡ": "w",
+    "ʏ": "y",
+    "ᴢ": "z",
+    # other confusables
+    "ı": "i",
+    "ł": "l",
+    "ø": "o",
+    "đ": "d",
+    "ħ": "h",
+    "ŧ": "t",
+    "ß": "ss",
+    "æ": "ae",
+    "œ": "oe",
+    "¢": "c",
+    "“": '"',
+    "”": '"',
+    "’": "'",
+    "‘": "'",
+    "′": "'",
+}
+
+# codepoints whose mapping is computed up front, everything else is folded on first use
+_PRECOMPUTED_RANGES = (
+    (0x0080, 0x3000),  # latin, greek, cyrillic, punctuation, super/subscripts, enclosed alphanumerics
+    (0xFB00, 0xFB50),  # ligatures
+    (0xFE00, 0xFE10),  # variation selectors
+    (0xFE20, 0xFE30),  # combining half marks
+    (0xFEFF, 0xFF00),  # zero width no-break space
+    (0xFF00, 0xFFF0),  # fullwidth forms
+    (0x1D400, 0x1D800),  # mathematical alphanumerics
+    (0x1F100, 0x1F200),  # enclosed alphanumerics supplement and regional indicators
+    (0x1F3FB, 0x1F400),  # skin tone modifiers
+    (0xE0000, 0xE0080),  # tags used by subdivision flags
+)
+
+_REGIONAL_INDICATOR_A = 0x1F1E6
+
+
+def _fold(char: str) -> str:
+    """
+    Returns the lowercase ascii form of a single character.
+    """
+    codepoint = ord(char)
+    if _REGIONAL_INDICATOR_A <= codepoint < _REGIONAL_INDICATOR_A + 26:
+        return chr(ord("a") + codepoint - _REGIONAL_INDICATOR_A)
+    if 0x1F3FB <= codepoint < 0x1F400:
+        return ""
+
+    homoglyph = HOMOGLYPHS.get(char.lower())
+    if homoglyph is not None:
+        return homoglyph
+
+    category = unicodedata.category(char)
+    if category in ("Cf", "Mn", "Me"):
+        return ""
+
+    folded = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+    folded = HOMOGLYPHS.get(folded.lower(), folded.lower())
+    if folded and folded.isascii():
+        return folded
+    return "*"
+
+
+class _TranslationTable(dict):
+    """
+    `str.translate` table that folds unknown codepoints once and remembers them.
+
+    The table always maps to a single character so indexes are kept. Characters that
+    are dropped or expand map to a NUL placeholder and their replacement is kept in
+    `expansions`.
+    """
+
+    def __init__(self):
+        super().__init__((c, chr(c).lower()) for c in range(128))
+        self.expansions: typing.Dict[str, str] = {}
+        # a real NUL can't be told apart from the placeholder, treat it like any unknown character
+        self[0] = "*"
+        for char in "~|`":
+            self[ord(char)] = "\0"
+
+    def __missing__(self, codepoint: int) -> str:
+        char = chr(codepoint)
+        folded = _fold(char)
+        if len(folded) != 1:
+            self.expansions[char] = folded
+            folded = "\0"
+        self[codepoint] = folded
+        return folded
+
+    def precompute(self, ranges: typing.Iterable[typing.Tuple[int, int]]):
+        for start, end in ranges:
+            for codepoint in range(start, end):
+                if unicodedata.category(chr(codepoint)) != "Cn":
+                    self[codepoint]
+
+
+TRANSLATION_TABLE = _TranslationTable()
+TRANSLATION_TABLE.precompute(_PRECOMPUTED_RANGES)
+
+_MARKUP_START = re.compile(r"[<*_]")
+_MARKUP = re.compile(r"<a?:\w+:\d+>|\*+|_+")
+_PLACEHOLDERS = re.compile("\0+")
+
+
+class NormalizedText:
+    """
+    Normalized form of a message along with the offset map back to the original.
+    """
+
+    __slots__ = ("original", "text", "_positions", "_anchors")
+
+    def __init__(self, original: str, text: str, anchors: typing.List[typing.Tuple[int, int, bool]]):
+        self.original = original
+        self.text = text
+        # (normalized index, original index, whether the piece maps one to one)
+        self._anchors = anchors
+        self._positions = [anchor[0] for anchor in anchors]
+
+    def __str__(self):
+        return self.text
+
+    def original_index(self, index: int) -> int:
+        """
+        Maps an index of the normalized text to the original text.
+        """
+        if not self._anchors:
+            return index
+        i = bisect.bisect_right(self._positions, index) - 1
+        if i < 0:
+            return index
+        normalized, original, literal = self._anchors[i]
+        return original + (index - normalized) if literal else original
+
+    def original_span(self, start: int, end: int) -> typing.Tuple[int, int]:
+        """
+        Maps a span of the normalized text to the span it came from in the original text.
+        """
+        if end <= start:
+            return self.original_index(start), self.original_index(start)
+        return self.original_index(start), self.original_index(end - 1) + 1
+
+
+def _is_alnum(text: str, index: int) -> bool:
+    return 0 <= index < len(text) and text[index].isalnum()
+
+
+def normalize(text: str) -> NormalizedText:
+    """
+    Normalizes a message for filtering in linear time.
+    """
+    translated = text.translate(TRANSLATION_TABLE)
+
+    # (start, end, replacement) of every part of the message that does not map one to one
+    events = []
+    if "\0" in translated:
+        expansions = TRANSLATION_TABLE.expansions
+        for run in _PLACEHOLDERS.finditer(translated):
+            start, end = run.span()
+            events.append((start, end, "".join(expansions.get(c, "") for c in text[start:end])))
+
+    if "<" in text or "*" in text or "_" in text:
+        pos = 0
+        while (candidate := _MARKUP_START.search(text, pos)) is not None:
+            markup = _MARKUP.match(text, candidate.start())
+            if markup is None:
+                pos = candidate.end()
+                continue
+            start, end = markup.span()
+            pos = end
+            if text[start] == "<":
+                events.append((start, end, "*"))
+            # runs of * or _ inside a word are kept, the filter treats them as wildcards
+            elif not (_is_alnum(text, start - 1) and _is_alnum(text, end)):
+                events.append((start, end, ""))
+
+    if not events:
+        return NormalizedText(text, translated, [])
+    events.sort()
+
+    pieces = []
+    anchors = []
+    out = 0
+    last = 0
+    for start, end, replacement in events:
+        if start < last:
+            continue
+        if start > last:
+            if anchors:
+                anchors.append((out, last, True))
+            pieces.append(translated[last:start])
+            out += start - last
+        anchors.append((out, start, False))
+        pieces.append(replacement)
+        out += len(replacement)
+        last = end
+
+    if last < len(text):
+        anchors.append((out, last, True))
+        pieces.append(translated[last:])
+    return NormalizedText(text, "".join(pieces), anchors)
@@ -0,0 +1,53 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Bounded LRU cache for automod verdicts.
+
+Repeated messages (copypasta, bot spam, "lol") normalize to the same text, so the verdict
+of the filter can be reused as long as the filter lists did not change.
+"""
+
+import typing
+
+from .lru import LRUCache
+
+MISSING = object()
+
+
+class VerdictCache(LRUCache[typing.Hashable, typing.Any]):
+    """
+    Least recently used cache of verdicts with hit and eviction counters.
+
+    Clearing the cache keeps the counters.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        super().__init__(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: typing.Hashable, default: typing.Any = MISSING) -> typing.Any:
+        """
+        Returns the cached verdict or MISSING.
+        """
+        verdict = super().get(key, default)
+        if verdict is default:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return verdict
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
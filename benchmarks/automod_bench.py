@@ -0,0 +1,516 @@
+# Copyright (C) 2024, Kurzgesagt Community Devs
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""
+Benchmarks of the automod filter that run without Discord, Mongo or network access.
+
+The Filter cog is built against in-memory filter lists and driven with a synthetic corpus
+generated from a seed: short chat, long walls of text, leetspeak evasion, emoji floods,
+Cyrillic homoglyphs and words spread over runs of joining characters. Every stage is timed
+in one pass and measured with tracemalloc in a second pass over a fresh Filter, so tracing
+doesn't skew the timings. Actions that would call Discord are replaced with no-ops, only
+the work automod does itself is measured.
+
+The run fails if a stage is slower, slower per message or allocates more than allowed by
+the thresholds file, or regresses beyond the tolerance against a saved baseline. It also
+fails if the matcher finds other words than the patterns of the old joining characters on
+short joining runs, the old patterns can't be run on long ones.
+
+Usage:
+    python3 benchmarks/automod_bench.py [--messages N] [--seed S] [--lists FILE]
+                                        [--traced N] [--thresholds FILE] [--baseline FILE]
+                                        [--tolerance T] [--save-baseline FILE]
+                                        [--joiner-checks N]
+
+Options:
+    --messages          Number of messages in the corpus
+    --seed              Seed of the corpus and the generated lists
+    --lists             JSON file with "general", "humanities" and "whitelist" lists to use instead
+    --traced            Number of calls of every stage measured with tracemalloc
+    --thresholds        JSON file of stage -> max_p99_us, min_per_second and max_alloc_kib
+    --baseline          Results saved by an earlier run to compare against
+    --tolerance         Allowed regression against the baseline, 0.5 is 50%
+    --save-baseline     Write the results of this run to a file
+    --joiner-checks     Number of generated inputs compared with the old joining characters
+"""
+
+import argparse
+import asyncio
+import copy
+import gc
+import inspect
+import json
+import pathlib
+import random
+import re
+import sys
+import time
+import tracemalloc
+import types
+import typing
+
+import discord
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app.birdbot import BirdBot  # noqa: E402
+from app.utils.config import Reference  # noqa: E402
+
+parser = argparse.ArgumentParser(description="Benchmark the automod filter")
+parser.add_argument("--messages", type=int, default=5000, help="Number of messages in the corpus")
+parser.add_argument("--seed", type=int, default=1, help="Seed of the corpus and the generated lists")
+parser.add_argument("--traced", type=int, default=1000, help="Calls of every stage measured with tracemalloc")
+parser.add_argument("--lists", type=pathlib.Path, help="JSON file with the filter lists to use")
+parser.add_argument(
+    "--thresholds",
+    type=pathlib.Path,
+    default=pathlib.Path(__file__).with_name("thresholds.json"),
+    help="JSON file with the limits of every stage",
+)
+parser.add_argument("--baseline", type=pathlib.Path, help="Results of an earlier run to compare against")
+parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed regression against the baseline")
+parser.add_argument("--save-baseline", type=pathlib.Path, help="Write the results of this run to a file")
+parser.add_argument("--joiner-checks", type=int, default=2000, help="Inputs compared with the old joining characters")
+
+VOCABULARY = (
+    "the be to of and a in that have i it for not on with he as you do at this but his by from they we say her "
+    "she or an will my one all would there their what so up out if about who get which go me when make can like "
+    "time no just him know take people into year your good some could them see other than then now look only "
+    "come its over think also back after use two how our work first well way even new want because any these "
+    "give day most us video bird space planet star universe black hole cell virus science energy lol yeah ok "
+    "thanks hello guys question answer maybe really cool great nice love watch channel episode"
+).split()
+EMOJI = (
+    "😀",
+    "😂",
+    "👍",
+    "🔥",
+    "❤️",
+    "🎉",
+    "🐦",
+    "👍🏽",
+    "👨‍👩‍👧",
+    "🏳️‍🌈",
+    "🇩🇪",
+    "1️⃣",
+    "<:kurzbird:123456789012345678>",
+    "<a:birddance:123456789012345679>",
+)
+LEETSPEAK = {"a": "4@", "e": "3", "i": "1!", "l": "1", "o": "0", "s": "$", "t": "+"}
+JOINERS = ".-_* "
+# characters that are both joining characters and substitutes of letters
+JOINING_SUBSTITUTES = "*@#$!+"
+# inputs that made the joining characters backtrack or were missed while fixing that
+JOINER_INPUTS = (
+    "sl*@g",
+    "tw€@t",
+    "t" + "+!$@" * 400,
+    "f" + "*" * 400 + "k",
+    "planet the our in no 1 " + "* " * 40 + "** *** 1",
+)
+# the words of the inputs above, added to the lists the joiner check runs against
+JOINER_WORDS = ("slag", "twat")
+OLD_JOINING_CHARS = r'[ _\-\+\.\*!@#$%^&():;\[\]\}\{\'"]*'
+HOMOGLYPHS = {"a": "а", "c": "с", "e": "е", "i": "і", "o": "о", "p": "р", "x": "х", "y": "у"}
+# share of the corpus of every kind of message
+KINDS = {"chat": 0.55, "wall": 0.1, "leet": 0.1, "emoji": 0.1, "homoglyph": 0.1, "joiner": 0.05}
+
+
+class MemoryCollection:
+    """
+    The part of a pymongo collection the filter reads, documents are kept in a list.
+    """
+
+    def __init__(self, documents: typing.Iterable[dict] = ()):
+        self.documents = list(documents)
+
+    def _matches(self, document: dict, query: dict | None) -> bool:
+        return all(document.get(key) == value for key, value in (query or {}).items())
+
+    def find_one(self, query: dict | None = None, *args, **kwargs) -> dict | None:
+        for document in self.documents:
+            if self._matches(document, query):
+                return copy.deepcopy(document)
+        return None
+
+    def find(self, query: dict | None = None, *args, **kwargs) -> typing.List[dict]:
+        return [copy.deepcopy(document) for document in self.documents if self._matches(document, query)]
+
+
+class MemoryDatabase:
+    """
+    Database with the filter lists, every other collection is empty.
+    """
+
+    def __init__(self, lists: typing.Dict[str, typing.List[str]]):
+        self.filterlist = MemoryCollection(
+            {"name": name, "filter": list(words), "version": 1} for name, words in lists.items()
+        )
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        collection = MemoryCollection()
+        setattr(self, name, collection)
+        return collection
+
+
+class BenchChannel(discord.TextChannel):
+    # only what the filter reads, the real constructor needs a connection state
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+        self.category_id = None
+
+
+class Sample(typing.NamedTuple):
+    kind: str
+    message: types.SimpleNamespace
+
+
+class StageResult(typing.NamedTuple):
+    name: str
+    count: int
+    per_second: float
+    p50_us: float
+    p99_us: float
+    alloc_kib: float
+    retained_kib: float
+
+
+def pseudo_word(rng: random.Random) -> str:
+    syllables = rng.randint(2, 4)
+    return "".join(rng.choice("bcdfghklmnprstvwz") + rng.choice("aeiou") for _ in range(syllables))
+
+
+def generate_lists(seed: int) -> typing.Dict[str, typing.List[str]]:
+    """
+    Filter lists of made up words, shaped like the real ones.
+    """
+    rng = random.Random(seed)
+    general = sorted({pseudo_word(rng) for _ in range(400)})
+    general += [f"{pseudo_word(rng)} {pseudo_word(rng)}" for _ in range(40)]
+    humanities = sorted({pseudo_word(rng) for _ in range(40)})
+    whitelist = [rng.choice(general) + rng.choice(("ing", "er", "ed", "ly")) for _ in range(50)]
+    whitelist += [f"{rng.choice(VOCABULARY)} {rng.choice(general)}" for _ in range(10)]
+    return {"general": general, "humanities": humanities, "whitelist": whitelist}
+
+
+def leetspeak(word: str, rng: random.Random) -> str:
+    chars = [rng.choice(LEETSPEAK[c]) if c in LEETSPEAK and rng.random() < 0.6 else c for c in word]
+    if rng.random() < 0.4:
+        return rng.choice(JOINERS).join(chars)
+    return "".join(chars)
+
+
+def joined(word: str, rng: random.Random) -> str:
+    """
+    The word with letters swapped for `*` or substitutes and short joining runs between them.
+    """
+    chars = []
+    for c in word:
+        if c != " " and rng.random() < 0.2:
+            c = "*"
+        elif c in LEETSPEAK and rng.random() < 0.3:
+            c = rng.choice(LEETSPEAK[c])
+        run = "".join(rng.choice(JOINING_SUBSTITUTES + JOINERS) for _ in range(rng.choice((0, 0, 1, 2, 3))))
+        chars.append(c + run)
+    return "".join(chars)
+
+
+def homoglyphs(text: str, rng: random.Random) -> str:
+    return "".join(HOMOGLYPHS[c] if c in HOMOGLYPHS and rng.random() < 0.5 else c for c in text)
+
+
+def chat(rng: random.Random, words: typing.List[str], length: int, profanity: float) -> typing.List[str]:
+    text = [rng.choice(VOCABULARY) for _ in range(length)]
+    if rng.random() < profanity:
+        text[rng.randrange(length)] = rng.choice(words)
+    return text
+
+
+def build_corpus(
+    lists: typing.Dict[str, typing.List[str]], count: int, seed: int, channel: BenchChannel
+) -> typing.List[Sample]:
+    """
+    Reproducible messages from a few hundred authors, some of whom repeat themselves.
+    """
+    rng = random.Random(seed)
+    words = [word for word in lists["general"] if " " not in word]
+    authors = [
+        types.SimpleNamespace(id=1000 + i, bot=False, roles=[], mention=f"<@{1000 + i}>", name=f"user{i}", nick=None)
+        for i in range(300)
+    ]
+    last: typing.Dict[int, str] = {}
+    corpus = []
+    for message_id in range(1, count + 1):
+        kind = rng.choices(list(KINDS), weights=list(KINDS.values()))[0]
+        if kind == "chat":
+            content = " ".join(chat(rng, words, rng.randint(3, 15), 0.05))
+        elif kind == "wall":
+            content = " ".join(chat(rng, words, rng.randint(300, 400), 0.3))
+        elif kind == "leet":
+            text = chat(rng, words, rng.randint(3, 15), 0)
+            text[rng.randrange(len(text))] = leetspeak(rng.choice(words), rng)
+            content = " ".join(text)
+        elif kind == "emoji":
+            text = chat(rng, words, rng.randint(1, 6), 0.02)
+            content = " ".join(text + [rng.choice(EMOJI) for _ in range(rng.randint(3, 30))])
+        elif kind == "homoglyph":
+            content = homoglyphs(" ".join(chat(rng, words, rng.randint(3, 15), 0.5)), rng)
+        elif rng.random() < 0.1:
+            content = rng.choice(JOINER_INPUTS)
+        else:
+            text = chat(rng, words, rng.randint(3, 15), 0)
+            text[rng.randrange(len(text))] = joined(rng.choice(words), rng)
+            content = " ".join(text)
+
+        author = rng.choice(authors)
+        # some authors repeat their last message
+        if author.id in last and rng.random() < 0.05:
+            content = last[author.id]
+        last[author.id] = content
+        mentions = [rng.choice(authors).id for _ in range(rng.randint(1, 8))] if rng.random() < 0.02 else []
+        message = types.SimpleNamespace(
+            id=message_id,
+            content=content,
+            channel=channel,
+            author=author,
+            guild=None,
+            embeds=[],
+            attachments=[],
+            mentions=[],
+            raw_mentions=mentions,
+            raw_role_mentions=[],
+            role_mentions=[],
+            jump_url=f"https://discord.com/channels/{Reference.guild}/{channel.id}/{message_id}",
+        )
+        corpus.append(Sample(kind, message))
+    return corpus
+
+
+def load_filter(lists: typing.Dict[str, typing.List[str]]):
+    """
+    Builds the Filter cog against the lists, with every Discord call replaced by a no-op.
+    """
+    BirdBot.db = MemoryDatabase(lists)  # type: ignore
+    # automod reads BirdBot.db when it is imported
+    from app.cogs import automod
+
+    bot = types.SimpleNamespace(db=BirdBot.db, get_channel=lambda id: None, get_guild=lambda id: None, commands=[])
+    bench_filter = automod.Filter(bot)  # type: ignore
+    bench_filter.media_classifier.probe_enabled = False
+
+    async def no_action(*args, **kwargs):
+        pass
+
+    bench_filter.execute_action_on_message = no_action
+    bench_filter.mute_author = no_action
+    bench_filter.delete_records = lambda records: None
+    return bench_filter
+
+
+def stages(bench_filter, corpus: typing.List[Sample]):
+    """
+    Returns stage name -> (function, setup, items), setup runs untimed before every call.
+    """
+    from app.utils.text_normalizer import normalize
+
+    channel = corpus[0].message.channel
+    bench_filter.channel_profiles[channel.id] = bench_filter.profiles["general"]
+    messages = [sample.message for sample in corpus]
+    repeats = [None] * 5
+
+    def clear_verdicts(message):
+        bench_filter.verdict_cache.clear()
+
+    def check_profanity(message):
+        return bench_filter.check_profanity(bench_filter.general_matcher, message.content)
+
+    # compiles are measured cold, the re module caches compiled patterns
+    def purge(_):
+        re.purge()
+
+    result = {
+        "generate_regex": (lambda _: bench_filter.generate_regex("general", bench_filter.general_list), purge, repeats),
+        "compile_matchers": (lambda _: bench_filter.compile_matchers(bench_filter.bundles), purge, repeats),
+        "normalize": (lambda message: normalize(message.content), None, messages),
+        "check_profanity": (check_profanity, clear_verdicts, messages),
+        "check_emoji_spam": (bench_filter.check_emoji_spam, None, messages),
+        "check_text_spam": (bench_filter.check_text_spam, bench_filter.message_history.add, messages),
+        "check_message": (bench_filter.check_message, None, messages),
+    }
+    for kind in KINDS:
+        samples = [sample.message for sample in corpus if sample.kind == kind]
+        result[f"check_profanity[{kind}]"] = (check_profanity, clear_verdicts, samples)
+    return result
+
+
+def percentile(ordered: typing.Sequence[int], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0
+
+
+async def time_stage(fn, setup, items) -> typing.List[int]:
+    timings = []
+    gc.collect()
+    for item in items:
+        if setup is not None:
+            setup(item)
+        start = time.perf_counter_ns()
+        result = fn(item)
+        if inspect.isawaitable(result):
+            await result
+        timings.append(time.perf_counter_ns() - start)
+    return timings
+
+
+async def trace_stage(fn, setup, items) -> typing.Tuple[float, float]:
+    """
+    Returns the mean peak of memory allocated by a call and the memory the stage kept, in KiB.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    peaks = 0
+    for item in items:
+        if setup is not None:
+            setup(item)
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn(item)
+        if inspect.isawaitable(result):
+            await result
+        peaks += tracemalloc.get_traced_memory()[1] - before
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peaks / max(len(items), 1) / 1024, (end - start) / 1024
+
+
+async def run(
+    lists: typing.Dict[str, typing.List[str]], count: int, seed: int, traced: int
+) -> typing.List[StageResult]:
+    channel = BenchChannel(Reference.Channels.general, "general")
+    corpus = build_corpus(lists, count, seed, channel)
+
+    timed = stages(load_filter(lists), corpus)
+    traced_stages = stages(load_filter(lists), corpus)
+    results = []
+    for name, (fn, setup, items) in timed.items():
+        timings = sorted(await time_stage(fn, setup, items))
+        # tracing is slow, the allocations of the first calls are representative
+        trace_fn, trace_setup, trace_items = traced_stages[name]
+        alloc_kib, retained_kib = await trace_stage(trace_fn, trace_setup, trace_items[:traced])
+        total = sum(timings) / 1e9
+        results.append(
+            StageResult(
+                name=name,
+                count=len(timings),
+                per_second=len(timings) / total if total else 0,
+                p50_us=percentile(timings, 0.5) / 1000,
+                p99_us=percentile(timings, 0.99) / 1000,
+                alloc_kib=alloc_kib,
+                retained_kib=retained_kib,
+            )
+        )
+    return results
+
+
+def print_results(results: typing.List[StageResult]):
+    print(f"{'stage':<28}{'n':>7}{'per second':>13}{'p50 us':>10}{'p99 us':>10}{'alloc KiB':>11}{'kept KiB':>10}")
+    for r in results:
+        print(
+            f"{r.name:<28}{r.count:>7}{r.per_second:>13.0f}{r.p50_us:>10.1f}{r.p99_us:>10.1f}"
+            f"{r.alloc_kib:>11.1f}{r.retained_kib:>10.1f}"
+        )
+
+
+def check_thresholds(results: typing.List[StageResult], thresholds: typing.Dict[str, dict]) -> typing.List[str]:
+    failures = []
+    for r in results:
+        limits = thresholds.get(r.name, {})
+        if "max_p99_us" in limits and r.p99_us > limits["max_p99_us"]:
+            failures.append(f"{r.name}: p99 {r.p99_us:.1f}us is above {limits['max_p99_us']}us")
+        if "min_per_second" in limits and r.per_second < limits["min_per_second"]:
+            failures.append(f"{r.name}: {r.per_second:.0f}/s is below {limits['min_per_second']}/s")
+        if "max_alloc_kib" in limits and r.alloc_kib > limits["max_alloc_kib"]:
+            failures.append(f"{r.name}: {r.alloc_kib:.1f}KiB allocated per call is above {limits['max_alloc_kib']}KiB")
+    return failures
+
+
+def check_joiners(lists: typing.Dict[str, typing.List[str]], count: int, seed: int) -> typing.List[str]:
+    """
+    Compares the words found by the matcher with the patterns of the old joining characters.
+    """
+    from app.utils.filter_matcher import FilterMatcher, PatternBundle, word_to_tokens
+    from app.utils.text_normalizer import normalize
+
+    words = lists["general"] + lists["humanities"] + list(JOINER_WORDS)
+    bundle = PatternBundle("joiners", words)
+    matcher = FilterMatcher([bundle])
+    old = [re.compile(r"\b(" + OLD_JOINING_CHARS.join(word_to_tokens(word)) + r")\b") for word in words]
+
+    rng = random.Random(seed)
+    # the old patterns backtrack exponentially on long runs, so only short inputs are compared
+    inputs = [text for text in JOINER_INPUTS if len(text) < 50]
+    for _ in range(count):
+        text = joined(rng.choice(words), rng)
+        inputs.append(rng.choice(("{}", "{} " + rng.choice(VOCABULARY), rng.choice(VOCABULARY) + " {}")).format(text))
+
+    failures = []
+    for text in inputs:
+        text = normalize(text).text
+        expected = [word for word, pattern in zip(words, old) if pattern.search(text)]
+        found = [word for word, pattern in zip(words, bundle.patterns) if pattern.search(text)]
+        if found != expected or bool(matcher.find(text)) != bool(expected):
+            failures.append(f"joiners: {text!r} matches {found} instead of {expected}")
+    return failures
+
+
+def check_baseline(
+    results: typing.List[StageResult], baseline: typing.Dict[str, dict], tolerance: float
+) -> typing.List[str]:
+    failures = []
+    for r in results:
+        base = baseline.get(r.name)
+        if base is None:
+            continue
+        if r.p99_us > base["p99_us"] * (1 + tolerance):
+            failures.append(f"{r.name}: p99 regressed from {base['p99_us']:.1f}us to {r.p99_us:.1f}us")
+        if r.per_second < base["per_second"] * (1 - tolerance):
+            failures.append(f"{r.name}: throughput regressed from {base['per_second']:.0f}/s to {r.per_second:.0f}/s")
+        # small allocations are noisy, only regressions of over a KiB count
+        if r.alloc_kib > base["alloc_kib"] * (1 + tolerance) + 1:
+            failures.append(f"{r.name}: allocations regressed from {base['alloc_kib']:.1f}KiB to {r.alloc_kib:.1f}KiB")
+    return failures
+
+
+def main() -> int:
+    args = parser.parse_args()
+    lists = json.loads(args.lists.read_text()) if args.lists else generate_lists(args.seed)
+    results = asyncio.run(run(lists, args.messages, args.seed, args.traced))
+    print_results(results)
+
+    failures = []
+    if args.thresholds.exists():
+        failures += check_thresholds(results, json.loads(args.thresholds.read_text()))
+    failures += check_joiners(lists, args.joiner_checks, args.seed)
+    if args.baseline:
+        failures += check_baseline(results, json.loads(args.baseline.read_text()), args.tolerance)
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps({r.name: r._asdict() for r in results}, indent=4))
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())